@@ -0,0 +1,232 @@
+"""Benchmarks of the extraction and stitching hot paths of the thumbnails package.
+
+The synthetic videos are generated locally with the ffmpeg binary bundled by imageio-ffmpeg
+for every combination of the given durations, resolutions, GOP sizes and codecs. Each case runs
+in a fresh process, so the peak RSS reported is the one of the case itself (including ffmpeg).
+
+    python benchmarks/bench.py --output results.json
+    python benchmarks/bench.py --output results.json --baseline previous.json
+
+The startup of the CLI is timed in fresh interpreters as well, as it is paid by every invocation
+and dominates the batch jobs invoking the CLI per video when most of them are skipped.
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+from imageio_ffmpeg import get_ffmpeg_exe
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Maps the codecs to the containers of the synthetic videos.
+CONTAINERS = {"libx264": "mp4", "mpeg4": "avi", "libtheora": "ogv"}
+
+# The metrics where a higher value is better, others are considered the lower the better.
+THROUGHPUT_METRICS = ("extract_fps", "prepare_fps", "videos_per_minute")
+RESOURCE_METRICS = ("peak_rss_kb", "import_seconds", "help_seconds", "skip_seconds")
+
+
+def synthesize(workdir, duration, resolution, gop, codec):
+    """Generates a synthetic test video, reuses the existing one with the same parameters."""
+    name = "%ds-%s-gop%d-%s.%s" % (duration, resolution, gop, codec, CONTAINERS[codec])
+    path = os.path.join(workdir, name)
+
+    if not os.path.exists(path):
+        subprocess.check_call((
+            get_ffmpeg_exe(),
+            "-loglevel", "error",
+            "-f", "lavfi",
+            "-i", "testsrc2=size=%s:rate=25:duration=%d" % (resolution, duration),
+            "-c:v", codec,
+            "-g", str(gop),
+            "-pix_fmt", "yuv420p",
+            path,
+            "-y",
+        ))
+
+    return path
+
+
+def peak_rss():
+    """Returns the peak RSS in kilobytes of the current process and its children."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage = max(usage, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # macOS reports the peak RSS in bytes.
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def isolated(func, *args):
+    """Runs the benchmark case in a fresh process."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def bench_video(path, compress, interval):
+    """Times the extraction, stitching and metadata writing of a single video."""
+    from thumbnails import ThumbnailVTT
+    from thumbnails.video import Video
+
+    with tempfile.TemporaryDirectory() as output:
+        video = Video(path, compress, interval)
+        start = time.perf_counter()
+        frames = sum(1 for _ in video.extract_frames())
+        extract = time.perf_counter() - start
+
+        thumbnail = ThumbnailVTT(Video(path, compress, interval), None, False, output)
+        start = time.perf_counter()
+        thumbnail.prepare_frames()
+        prepare = time.perf_counter() - start
+
+        start = time.perf_counter()
+        thumbnail.generate()
+        generate = time.perf_counter() - start
+
+    return {
+        "frames": frames,
+        "extract_seconds": extract,
+        "extract_fps": frames / extract,
+        "prepare_seconds": prepare,
+        "prepare_fps": frames / prepare,
+        "generate_seconds": generate,
+        "peak_rss_kb": peak_rss(),
+    }
+
+
+def bench_generator(paths, compress, interval, workers):
+    """Times the end-to-end generation of all the videos by the given number of workers."""
+    from thumbnails import Generator
+
+    with tempfile.TemporaryDirectory() as output:
+        generator = Generator(paths)
+        generator.output = output
+        generator.compress = compress
+        generator.interval = interval
+        generator.workers = workers
+        generator.progress = "none"
+
+        start = time.perf_counter()
+        generator.generate()
+        elapsed = time.perf_counter() - start
+
+    return {
+        "videos": len(paths),
+        "seconds": elapsed,
+        "videos_per_minute": len(paths) * 60 / elapsed,
+        "peak_rss_kb": peak_rss(),
+    }
+
+
+def bench_startup(path, repeat):
+    """Times the import of the package, the help and a skipping run of the CLI in fresh interpreters."""
+    with tempfile.TemporaryDirectory() as output:
+        cli = (sys.executable, "-m", "thumbnails", "--output", output, "--progress", "none")
+        subprocess.check_call(cli + (path,), stdout=subprocess.DEVNULL)
+
+        commands = {
+            "import_seconds": (sys.executable, "-c", "import thumbnails.__main__"),
+            "help_seconds": (sys.executable, "-m", "thumbnails", "--help"),
+            "skip_seconds": cli + ("--skip", path),
+        }
+        timings = {}
+        for metric, command in commands.items():
+            elapsed = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.check_call(command, stdout=subprocess.DEVNULL)
+                elapsed.append(time.perf_counter() - start)
+            # The fastest run is the least disturbed by the other processes and the cold disk cache.
+            timings[metric] = min(elapsed)
+
+    return timings
+
+
+def regressions(results, baseline, tolerance):
+    """Compares the results with the baseline and lists the regressed metrics."""
+    baseline = {case["case"]: case for case in baseline["cases"]}
+
+    for case in results["cases"]:
+        previous = baseline.get(case["case"])
+        if previous is None:
+            continue
+        for metric in THROUGHPUT_METRICS + RESOURCE_METRICS:
+            current, expected = case.get(metric), previous.get(metric)
+            if not current or not expected:
+                continue
+            if metric in THROUGHPUT_METRICS and current < expected * (1 - tolerance) or \
+                    metric in RESOURCE_METRICS and current > expected * (1 + tolerance):
+                yield "%s: %s is %.2f, the baseline is %.2f" % (case["case"], metric, current, expected)
+
+
+def split(value):
+    """Splits the comma-separated option value."""
+    return [item for item in value.split(",") if item]
+
+
+@click.command()
+@click.option("--durations", default="30,120", help="The durations of the synthetic videos in seconds.")
+@click.option("--resolutions", default="1280x720,1920x1080", help="The resolutions of the synthetic videos.")
+@click.option("--gops", default="25,250", help="The GOP sizes of the synthetic videos.")
+@click.option("--codecs", default="libx264,mpeg4", help="The codecs of the synthetic videos.")
+@click.option("--workers", default="1,2,4", help="The worker counts of the end-to-end runs.")
+@click.option("--compress", default=0.1, help="The image scale coefficient.")
+@click.option("--interval", default=1.0, help="The interval between neighbor thumbnails in seconds.")
+@click.option("--repeat", default=5, help="The runs of the startup cases, the fastest one is reported.")
+@click.option("--workdir", default=None, type=click.Path(), help="The directory for the synthetic videos.")
+@click.option("--output", default=None, type=click.Path(), help="The JSON results file. Default is stdout.")
+@click.option("--baseline", default=None, type=click.Path(exists=True), help="The JSON results to compare with.")
+@click.option("--tolerance", default=0.2, help="The allowed relative regression against the baseline.")
+def main(durations, resolutions, gops, codecs, workers, compress, interval, repeat, workdir, output, baseline,
+         tolerance):
+    workdir = workdir or os.path.join(tempfile.gettempdir(), "thumbnails-benchmarks")
+    os.makedirs(workdir, exist_ok=True)
+
+    paths = []
+    cases = []
+    matrix = itertools.product(map(int, split(durations)), split(resolutions), map(int, split(gops)), split(codecs))
+
+    for duration, resolution, gop, codec in matrix:
+        path = synthesize(workdir, duration, resolution, gop, codec)
+        paths.append(path)
+        case = {"case": "video/" + os.path.basename(path), "compress": compress, "interval": interval}
+        case.update(isolated(bench_video, path, compress, interval))
+        cases.append(case)
+
+    for count in map(int, split(workers)):
+        case = {"case": "generator/workers=%d" % count, "compress": compress, "interval": interval}
+        case.update(isolated(bench_generator, paths, compress, interval, count))
+        cases.append(case)
+
+    case = {"case": "startup/" + os.path.basename(paths[0])}
+    case.update(bench_startup(paths[0], repeat))
+    cases.append(case)
+
+    results = {"python": sys.version.split()[0], "platform": sys.platform, "cases": cases}
+
+    if output:
+        with open(output, "w") as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if baseline:
+        with open(baseline) as fp:
+            failures = list(regressions(results, json.load(fp), tolerance))
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        sys.exit(bool(failures))
+
+
+if __name__ == "__main__":
+    main()
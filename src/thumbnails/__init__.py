@@ -14,21 +14,47 @@
    limitations under the License.
 """
 
+from .aio import AsyncGenerator
+from .canvas import Canvas
+from .canvas import register_canvas
+from .encoder import Encoder
+from .encoder import register_encoder
 from .generator import Generator
+from .result import Cue
+from .result import Result
+from .scheduler import MemoryBudget
+from .scheduler import Scheduler
+from .sink import FileSink
+from .sink import MemorySink
+from .sink import Sink
 from .thumbnail import Thumbnail
 from .thumbnail import ThumbnailExistsError
 from .thumbnail import ThumbnailFactory
 from .thumbnail import ThumbnailJSON
 from .thumbnail import ThumbnailVTT
 from .thumbnail import register_thumbnail
+from .workqueue import WorkQueue
 
 __version__ = "0.1.12"
 __all__ = (
+    "AsyncGenerator",
+    "Canvas",
+    "Cue",
+    "Encoder",
+    "FileSink",
     "Generator",
+    "MemoryBudget",
+    "MemorySink",
+    "Result",
+    "Scheduler",
+    "Sink",
     "Thumbnail",
     "ThumbnailExistsError",
     "ThumbnailFactory",
     "ThumbnailJSON",
     "ThumbnailVTT",
+    "WorkQueue",
+    "register_canvas",
+    "register_encoder",
     "register_thumbnail",
 )
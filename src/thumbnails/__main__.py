@@ -12,7 +12,12 @@ def main(inputs=None, **options):
     for option, value in options.items():
         setattr(generator, option, value)
 
-    generator.generate()
+    # The results are streamed, so they are not retained for the whole batch.
+    failed = sum(result.error is not None for result in generator.results())
+
+    # Exit with an error status if any video has failed, so the batch jobs can detect it.
+    if failed:
+        exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+import asyncio
+
+from .generator import Generator
+from .progress import Progress
+from .video import Video
+
+
+class AsyncGenerator(Generator):
+    """This class gives an asyncio interface of the generator for embedding in services.
+
+    The videos are processed by the default executor of the running event loop, so concurrent
+    generators share its threads instead of spawning a pool per call. Every generator owns its budgets
+    of ffmpeg processes and memory, unless a scheduler is given for sharing them. The progress is disabled
+    by default, and the cancellation of the awaiting task kills the running ffmpeg processes.
+
+        async for result in AsyncGenerator(inputs):
+            ...
+
+        results = await AsyncGenerator(inputs).generate()
+    """
+
+    def __init__(self, inputs):
+        super().__init__(inputs)
+        self.progress = "none"
+
+    def __aiter__(self):
+        return self.results()
+
+    async def results(self):
+        """This asynchronous generator function yields the results of the videos as they are finished."""
+        loop = asyncio.get_running_loop()
+        worker = self.prepare_worker()
+        hooks = self.prepare_hooks()
+        videos = iter(self)
+        pending = {}
+
+        Progress.start(self.progress)
+        self._scheduler = self.prepare_scheduler()
+
+        try:
+            while True:
+                while len(pending) < self.workers:
+                    video = await loop.run_in_executor(None, next, videos, None)
+                    if video is None:
+                        break
+                    pending[loop.run_in_executor(None, worker, video)] = video
+
+                if not pending:
+                    # The inputs are processed again while the jobs of the crashed workers of the queue are reclaimed.
+                    if self.work_queue is None or not await loop.run_in_executor(None, self.work_queue.wait):
+                        break
+                    videos = iter(self)
+                    continue
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    result = future.result()
+                    for hook in hooks:
+                        hook(result)
+                    yield result
+
+            if self.storage:
+                await loop.run_in_executor(None, self.storage.evict)
+        finally:
+            # Kill the ffmpeg processes of the unfinished videos and wait for their workers to unwind.
+            for video in pending.values():
+                if isinstance(video, Video):
+                    video.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            Progress.stop()
+
+    async def generate(self):
+        """Generates the thumbnails of all the inputs and returns the results of the videos."""
+        return [result async for result in self.results()]
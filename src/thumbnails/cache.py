@@ -0,0 +1,142 @@
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+# The size of the chunks read from the beginning and the end of a file for fingerprinting.
+FINGERPRINT_CHUNK = 64 * 1024
+
+# The share of the size limit written to the cache before it is evicted again, i.e. its overflow.
+EVICT_RATIO = 0.1
+
+
+class Cache:
+    """This class gives a persistent content-addressed storage of the extracted frames and metadata.
+
+    The cache is a directory of entries, each of which is a directory named by the key of
+    the entry. The entries are evicted in the least recently used order once the total size
+    of the cache exceeds the given limit. The eviction runs whenever a share of the limit
+    has been written since the last one, so the cache stays bounded during long runs.
+    """
+
+    _written = collections.Counter()  # The bytes written per cache directory since its last eviction.
+    _lock = threading.Lock()
+
+    def __init__(self, directory, size):
+        self.directory = os.path.abspath(directory)
+        self.size = size
+
+    @staticmethod
+    def fingerprint(filepath):
+        """Calculates a fast fingerprint of the file by its size, mtime and partial content."""
+        stat = os.stat(filepath)
+        digest = hashlib.sha1(b"%d:%d" % (stat.st_size, stat.st_mtime_ns))
+
+        with open(filepath, "rb") as fp:
+            digest.update(fp.read(FINGERPRINT_CHUNK))
+            fp.seek(max(stat.st_size - FINGERPRINT_CHUNK, 0))
+            digest.update(fp.read(FINGERPRINT_CHUNK))
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(*parts):
+        """Calculates the key of an entry by the given parts."""
+        return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+    def _path(self, key, name):
+        """Returns the path of the file in the entry."""
+        return os.path.join(self.directory, key, name)
+
+    @contextlib.contextmanager
+    def open(self, key, name):
+        """Opens the file of the entry for reading, yields None if it does not exist."""
+        try:
+            fp = open(self._path(key, name), "rb")
+        except FileNotFoundError:
+            yield None
+            return
+
+        with fp:
+            # Mark the entry as recently used.
+            os.utime(os.path.join(self.directory, key))
+            yield fp
+
+    @contextlib.contextmanager
+    def create(self, key, name):
+        """Opens the file of the entry for writing, commits it atomically on success.
+
+        The file is dropped instead if it exceeds the size limit, since it would only evict the others.
+        """
+        basedir = os.path.join(self.directory, key)
+        os.makedirs(basedir, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=basedir, prefix=".")
+
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                yield fp
+                size = fp.tell()
+            if size > self.size:
+                os.remove(temp)
+                with contextlib.suppress(OSError):
+                    os.rmdir(basedir)
+                return
+            os.replace(temp, self._path(key, name))
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp)
+            raise
+
+        with self._lock:
+            self._written[self.directory] += size
+            if self._written[self.directory] < self.size * EVICT_RATIO:
+                return
+            self._written[self.directory] = 0
+        self.evict(keep=basedir)
+
+    def load(self, key, name):
+        """Loads the JSON data of the entry, returns None if it does not exist."""
+        with self.open(key, name) as fp:
+            return json.load(fp) if fp else None
+
+    def store(self, key, name, data):
+        """Stores the JSON data into the entry."""
+        with self.create(key, name) as fp:
+            fp.write(json.dumps(data).encode())
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the cache fits the size limit.
+
+        The entries being written, i.e. containing the temporary files, are never removed.
+
+        :param keep:
+            The path of the entry which is never removed, e.g. the one just committed.
+        """
+        if not os.path.isdir(self.directory):
+            return
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            try:
+                files = list(os.scandir(entry.path))
+                if any(file.name.startswith(".") for file in files):
+                    continue
+                size = sum(file.stat().st_size for file in files)
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.size:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,207 @@
+import importlib.util
+import io
+import struct
+import zlib
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def register_canvas(typename, module=None):
+    """Register a new stitching backend into the canvas.
+
+    :param module:
+        The module required by the backend, it is registered only if the module is installed.
+    """
+
+    def _register_backend(cls):
+        if not issubclass(cls, Canvas):
+            raise ValueError("%s should be a Canvas." % cls.__name__)
+
+        if module is None or importlib.util.find_spec(module) is not None:
+            Canvas.backends[typename] = cls
+        return cls
+
+    return _register_backend
+
+
+class Canvas:
+    """Any stitching backend of the sprite sheets should implement the base Canvas.
+
+    The tiles are pasted in the row-major order, and the sheet is encoded to the file object once closed.
+    """
+
+    backends = {}
+    formats = None  # None is a flag for supporting all the image formats.
+
+    def __init__(self, size, encoder, fp):
+        self.size = size
+        self.encoder = encoder
+        self.fp = fp
+
+    @classmethod
+    def backend(cls, typename, fmt):
+        """Returns the backend by the given typename, which should support the image format."""
+        try:
+            backend = cls.backends[typename]
+        except KeyError:
+            raise ValueError("The canvas '%s' is not registered." % typename)
+        if backend.formats is not None and fmt not in backend.formats:
+            raise ValueError("The canvas '%s' does not support the image format '%s'." % (typename, fmt))
+        return backend
+
+    @classmethod
+    def memory(cls, size, tile_size):
+        """Estimates the peak memory of a sheet in bytes."""
+        raise NotImplementedError
+
+    def paste(self, image, xy):
+        """Pastes the tile at the given offset."""
+        raise NotImplementedError
+
+    def close(self):
+        """Encodes the rest of the sheet."""
+        raise NotImplementedError
+
+
+@register_canvas("pillow")
+class PillowCanvas(Canvas):
+    """This canvas keeps the whole sheet in memory and encodes it at once."""
+
+    def __init__(self, size, encoder, fp):
+        from PIL import Image
+
+        super().__init__(size, encoder, fp)
+        self.image = Image.new(mode="RGB", size=size)
+
+    @classmethod
+    def memory(cls, size, tile_size):
+        # Pillow keeps the RGB pixels in 4 bytes.
+        return size[0] * size[1] * 4
+
+    def paste(self, image, xy):
+        self.image.paste(image, xy)
+
+    def close(self):
+        self.encoder.save(self.image, self.fp)
+
+
+@register_canvas("stream")
+class StreamCanvas(Canvas):
+    """This canvas keeps a single row of the tiles in memory, the filled rows are encoded right away.
+
+    The rows are filtered by the PNG encoder of Pillow, so the sheet is as compact as encoded at once,
+    and their scanlines are compressed into a single stream of the sheet.
+    """
+
+    formats = ("png",)
+
+    def __init__(self, size, encoder, fp):
+        super().__init__(size, encoder, fp)
+        self._row = None
+        self._offset = 0  # The count of the encoded scanlines.
+        self._last = None  # The last encoded scanline, the next row is filtered against it.
+        self._compressor = zlib.compressobj(6)
+
+        self.fp.write(PNG_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], 8, 2, 0, 0, 0))
+
+    @classmethod
+    def memory(cls, size, tile_size):
+        # The row and its prefixed copy in 4 bytes per pixel, the stored PNG and its scanlines in 3 bytes.
+        return size[0] * tile_size[1] * 14
+
+    def _chunk(self, kind, data):
+        """Writes a PNG chunk of the given kind."""
+        self.fp.write(struct.pack(">I", len(data)) + kind + data)
+        self.fp.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+    def _scanlines(self, image):
+        """Returns the filtered scanlines of the image, following the last encoded scanline."""
+        from PIL import Image
+
+        if self._last is not None:
+            # The row is prefixed by the last scanline, so its first scanline is filtered against it.
+            prefixed = Image.new("RGB", (image.width, image.height + 1))
+            prefixed.paste(self._last, (0, 0))
+            prefixed.paste(image, (0, 1))
+            image = prefixed
+
+        with io.BytesIO() as png:
+            # The PNG is stored uncompressed, only the filtered scanlines are taken from its chunks.
+            image.save(png, format="PNG", compress_level=0)
+            data, offset = png.getvalue(), len(PNG_SIGNATURE)
+
+        compressed = []
+        while offset < len(data):
+            length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+            if kind == b"IDAT":
+                compressed.append(data[offset + 8:offset + 8 + length])
+            offset += length + 12
+
+        scanlines = zlib.decompress(b"".join(compressed))
+        return scanlines[image.width * 3 + 1:] if self._last is not None else scanlines
+
+    def _encode(self, image):
+        """Encodes the image as the next scanlines of the sheet."""
+        compressed = self._compressor.compress(self._scanlines(image))
+        if compressed:
+            self._chunk(b"IDAT", compressed)
+        self._last = image.crop((0, image.height - 1, image.width, image.height))
+        self._offset += image.height
+
+    def _flush(self, stop):
+        """Encodes the filled row and the empty scanlines up to the given one."""
+        from PIL import Image
+
+        if self._row is not None:
+            self._encode(self._row)
+            self._row = None
+        if stop > self._offset:
+            self._encode(Image.new("RGB", (self.size[0], stop - self._offset)))
+
+    def paste(self, image, xy):
+        from PIL import Image
+
+        x, y = xy
+        if self._row is None or y != self._offset:
+            self._flush(y)
+            self._row = Image.new("RGB", (self.size[0], image.height))
+        self._row.paste(image, (x, 0))
+
+    def close(self):
+        self._flush(self.size[1])
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+
+
+@register_canvas("numpy", module="numpy")
+class NumpyCanvas(Canvas):
+    """This canvas composes the sheet in a contiguous array, the tiles are placed by slice assignment.
+
+    The frames are copied into the array without creating intermediate images, and the array is
+    handed to the encoder as the buffer of the sheet image.
+    """
+
+    def __init__(self, size, encoder, fp):
+        import numpy
+
+        super().__init__(size, encoder, fp)
+        self.array = numpy.zeros((size[1], size[0], 3), dtype=numpy.uint8)
+
+    @classmethod
+    def memory(cls, size, tile_size):
+        # The array in 3 bytes per pixel and the image of the encoder in 4 bytes.
+        return size[0] * size[1] * 7
+
+    def paste(self, image, xy):
+        import numpy
+
+        x, y = xy
+        tile = numpy.frombuffer(image.tobytes(), dtype=numpy.uint8).reshape(image.height, image.width, 3)
+        self.array[y:y + image.height, x:x + image.width] = tile
+
+    def close(self):
+        from PIL import Image
+
+        image = Image.frombuffer("RGB", self.size, self.array, "raw", "RGB", 0, 1)
+        self.encoder.save(image, self.fp)
@@ -2,38 +2,142 @@ import functools
 
 import click
 
+from . import Canvas
+from . import Encoder
 from . import ThumbnailFactory
 from . import __version__
+from .constants import DEFAULT_APPEND
 from .constants import DEFAULT_BASE
+from .constants import DEFAULT_CACHE
+from .constants import DEFAULT_CACHE_SIZE
+from .constants import DEFAULT_CANVAS
 from .constants import DEFAULT_COMPRESS
+from .constants import DEFAULT_DEDUP
+from .constants import DEFAULT_EXCLUDE
+from .constants import DEFAULT_EXTENSIONS
+from .constants import DEFAULT_FAILURES
 from .constants import DEFAULT_FORMAT
+from .constants import DEFAULT_IMAGE_FORMAT
+from .constants import DEFAULT_INCLUDE
 from .constants import DEFAULT_INTERVAL
+from .constants import DEFAULT_JOBS
+from .constants import DEFAULT_KEYFRAMES
+from .constants import DEFAULT_LOWRES
+from .constants import DEFAULT_MANIFEST
+from .constants import DEFAULT_MAX_FRAMES
+from .constants import DEFAULT_MEMORY
+from .constants import DEFAULT_METRICS
 from .constants import DEFAULT_OUTPUT
+from .constants import DEFAULT_PARALLELISM
+from .constants import DEFAULT_PROCESSES
+from .constants import DEFAULT_PROGRESS
+from .constants import DEFAULT_PROMETHEUS
+from .constants import DEFAULT_QUALITY
+from .constants import DEFAULT_QUEUE
+from .constants import DEFAULT_RETRIES
+from .constants import DEFAULT_SCALER
+from .constants import DEFAULT_SCENE
+from .constants import DEFAULT_SHEET
 from .constants import DEFAULT_SKIP
+from .constants import DEFAULT_THREADS
+from .constants import DEFAULT_TIMEOUT
 from .constants import DEFAULT_WORKERS
+from .progress import MODES
+from .video import MAX_LOWRES
+from .video import SCALERS
 
 # Help messages of the particular option of the CLI.
 HELP_BASE = "The prefix of the thumbnails path can be customized."
 HELP_SKIP = "Skip the existing thumbnails. Default is not set."
+HELP_APPEND = "Extract only the frames past the existing thumbnails of the growing videos. Default is not set."
 HELP_OUTPUT = "The output directory. Default is the current directory."
-HELP_FORMAT = "Output format. Default is %s." % DEFAULT_FORMAT
-HELP_COMPRESS = "The image scale coefficient. A number from 0 to 1."
+HELP_FORMAT = "Output format. Can be repeated, the formats share the extraction. Default is %s." % DEFAULT_FORMAT
+HELP_IMAGE_FORMAT = "The image format of the sprite sheets and frames. Default is %s." % DEFAULT_IMAGE_FORMAT
+HELP_QUALITY = "The quality of the lossy image formats. A number from 1 to 100. Default is %d." % DEFAULT_QUALITY
+HELP_CANVAS = "The stitching backend, stream keeps a single row of a sheet in memory. Default is %s." % DEFAULT_CANVAS
+HELP_COMPRESS = "The image scale coefficient. A number from 0 to 1. Can be repeated, the outputs are named by width."
 HELP_INTERVAL = "The interval between neighbor thumbnails in seconds."
+HELP_SHEET = "The maximum columns and rows of a sprite sheet, paging into numbered sheets. Default is a single sheet."
+HELP_KEYFRAMES = "Snap the thumbnails to the nearest keyframes for faster extraction."
+HELP_SCENE = "Sample the frames by the scene changes above the threshold instead of the interval. A number from 0 to 1."
+HELP_MAX_FRAMES = "The maximum number of frames sampled by the scene changes. Default is unlimited."
+HELP_DEDUP = "Collapse the consecutive frames within the perceptual hash distance. A number from 0 to 64."
 HELP_WORKERS = "Workers number for concurrent processing. Default is calculated automatically."
+HELP_JOBS = "Maximum number of ffmpeg processes shared by all workers. Default is calculated automatically."
+HELP_PARALLELISM = "Number of ffmpeg processes extracting the frames of a single video. Default is 1."
+HELP_TIMEOUT = "Kill the ffmpeg process stalled for the seconds without emitting a frame. Default is unlimited."
+HELP_RETRIES = "Number of retries of the transient failures with a backoff. Default is %d." % DEFAULT_RETRIES
+HELP_THREADS = "Number of decoding threads of an ffmpeg process. Default is split by the processes or by ffmpeg."
+HELP_SCALER = "The scaling algorithm of the frames. Default is chosen by the downscale ratio."
+HELP_LOWRES = "Decode at 1/2^N of the resolution where supported. Default is chosen by the downscale ratio."
+HELP_PROCESSES = "Use processes instead of threads for the workers. Default is not set."
+HELP_MEMORY = "The memory budget in megabytes, the videos are admitted while it is not exceeded. Default is unlimited."
+HELP_CACHE = "The directory for caching the extracted frames and metadata. Default is not set."
+HELP_CACHE_SIZE = "The size limit of the cache in megabytes. Default is %d." % DEFAULT_CACHE_SIZE
+HELP_MANIFEST = "The journal of the job for resuming it from the completed stages of the videos. Default is not set."
+HELP_QUEUE = "The shared directory of the work queue, the inputs are processed by all the workers using it."
+HELP_EXTENSIONS = "The allowed extension of the input videos. Can be repeated. Default is any."
+HELP_INCLUDE = "Process only the inputs matching the glob pattern. Can be repeated."
+HELP_EXCLUDE = "Skip the inputs matching the glob pattern. Can be repeated."
+HELP_METRICS = "Append the per-video timings and counters to the JSON-lines file. Default is not set."
+HELP_PROMETHEUS = "Write the aggregated timings and counters to the Prometheus text file. Default is not set."
+HELP_FAILURES = "Append the failed videos to the JSON-lines file for resuming them later. Default is not set."
+HELP_PROGRESS = "The progress rendering mode, none disables it. Default is %s." % DEFAULT_PROGRESS
 
 # This defines a choice of supported values for the '--format' option of the CLI.
 format_choice = click.Choice(ThumbnailFactory.thumbnails.keys(), case_sensitive=False)
 
+# This defines a choice of supported values for the '--image-format' option of the CLI.
+image_choice = click.Choice(Encoder.formats.keys(), case_sensitive=False)
+
+# This defines a choice of supported values for the '--canvas' option of the CLI.
+canvas_choice = click.Choice(Canvas.backends.keys(), case_sensitive=False)
+
+# This defines a range of supported values for the '--sheet' option of the CLI.
+sheet_range = click.IntRange(min=1)
+
+# This defines a choice of supported values for the '--progress' option of the CLI.
+progress_choice = click.Choice(MODES, case_sensitive=False)
+
 
 def cli(func):
     @click.command()
-    @click.option("--compress", "-C", default=DEFAULT_COMPRESS, help=HELP_COMPRESS)
+    @click.option("--compress", "-C", default=(DEFAULT_COMPRESS,), help=HELP_COMPRESS, multiple=True)
     @click.option("--interval", "-I", default=DEFAULT_INTERVAL, help=HELP_INTERVAL)
+    @click.option("--sheet", default=DEFAULT_SHEET, type=(sheet_range, sheet_range), help=HELP_SHEET)
+    @click.option("--keyframes", default=DEFAULT_KEYFRAMES, help=HELP_KEYFRAMES, is_flag=True)
+    @click.option("--scene", default=DEFAULT_SCENE, type=click.FloatRange(0, 1), help=HELP_SCENE)
+    @click.option("--max-frames", default=DEFAULT_MAX_FRAMES, type=click.IntRange(min=0), help=HELP_MAX_FRAMES)
+    @click.option("--dedup", default=DEFAULT_DEDUP, type=click.IntRange(0, 64), help=HELP_DEDUP)
     @click.option("--workers", "-W", default=DEFAULT_WORKERS, help=HELP_WORKERS)
+    @click.option("--jobs", default=DEFAULT_JOBS, help=HELP_JOBS)
+    @click.option("--parallelism", default=DEFAULT_PARALLELISM, help=HELP_PARALLELISM)
+    @click.option("--timeout", default=DEFAULT_TIMEOUT, type=click.FloatRange(min=0), help=HELP_TIMEOUT)
+    @click.option("--retries", default=DEFAULT_RETRIES, type=click.IntRange(min=0), help=HELP_RETRIES)
+    @click.option("--threads", default=DEFAULT_THREADS, type=click.IntRange(min=0), help=HELP_THREADS)
+    @click.option("--scaler", default=DEFAULT_SCALER, type=click.Choice(SCALERS), help=HELP_SCALER)
+    @click.option("--lowres", default=DEFAULT_LOWRES, type=click.IntRange(0, MAX_LOWRES), help=HELP_LOWRES)
+    @click.option("--memory", default=DEFAULT_MEMORY, type=click.IntRange(min=0), help=HELP_MEMORY)
+    @click.option("--processes", default=DEFAULT_PROCESSES, help=HELP_PROCESSES, is_flag=True)
     @click.option("--base", "-B", default=DEFAULT_BASE, help=HELP_BASE)
     @click.option("--skip", "-S", default=DEFAULT_SKIP, help=HELP_SKIP, is_flag=True)
+    @click.option("--append", default=DEFAULT_APPEND, help=HELP_APPEND, is_flag=True)
+    @click.option("--cache", default=DEFAULT_CACHE, type=click.Path(), help=HELP_CACHE)
+    @click.option("--cache-size", default=DEFAULT_CACHE_SIZE, help=HELP_CACHE_SIZE)
+    @click.option("--manifest", default=DEFAULT_MANIFEST, type=click.Path(), help=HELP_MANIFEST)
+    @click.option("--queue", default=DEFAULT_QUEUE, type=click.Path(), help=HELP_QUEUE)
     @click.option("--output", "-O", default=DEFAULT_OUTPUT, type=click.Path(), help=HELP_OUTPUT)
-    @click.option("--format", "-F", default=DEFAULT_FORMAT, type=format_choice, help=HELP_FORMAT)
+    @click.option("--format", "-F", default=(DEFAULT_FORMAT,), type=format_choice, help=HELP_FORMAT, multiple=True)
+    @click.option("--image-format", default=DEFAULT_IMAGE_FORMAT, type=image_choice, help=HELP_IMAGE_FORMAT)
+    @click.option("--quality", default=DEFAULT_QUALITY, type=click.IntRange(1, 100), help=HELP_QUALITY)
+    @click.option("--canvas", default=DEFAULT_CANVAS, type=canvas_choice, help=HELP_CANVAS)
+    @click.option("--extension", "extensions", default=DEFAULT_EXTENSIONS, help=HELP_EXTENSIONS, multiple=True)
+    @click.option("--include", default=DEFAULT_INCLUDE, help=HELP_INCLUDE, multiple=True)
+    @click.option("--exclude", default=DEFAULT_EXCLUDE, help=HELP_EXCLUDE, multiple=True)
+    @click.option("--metrics", default=DEFAULT_METRICS, type=click.Path(), help=HELP_METRICS)
+    @click.option("--prometheus", default=DEFAULT_PROMETHEUS, type=click.Path(), help=HELP_PROMETHEUS)
+    @click.option("--failures", default=DEFAULT_FAILURES, type=click.Path(), help=HELP_FAILURES)
+    @click.option("--progress", default=DEFAULT_PROGRESS, type=progress_choice, help=HELP_PROGRESS)
     @click.argument("inputs", required=True, type=click.Path(), nargs=-1)
     @click.version_option(__version__, "-V", "--version")
     @click.help_option("-h", "--help")
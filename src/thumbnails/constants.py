@@ -1,7 +1,36 @@
 DEFAULT_BASE = None
 DEFAULT_SKIP = False
+DEFAULT_APPEND = False
 DEFAULT_OUTPUT = None
 DEFAULT_FORMAT = "vtt"
+DEFAULT_IMAGE_FORMAT = "png"
+DEFAULT_QUALITY = 80
+DEFAULT_CANVAS = "pillow"
 DEFAULT_COMPRESS = 1.0
 DEFAULT_INTERVAL = 1.0
+DEFAULT_SHEET = None  # None is a flag for merging all the frames into a single sprite sheet.
+DEFAULT_KEYFRAMES = False
+DEFAULT_SCENE = 0.0  # 0 is a flag for sampling the frames by the fixed interval.
+DEFAULT_MAX_FRAMES = 0  # 0 is a flag for keeping all the scene changes.
+DEFAULT_DEDUP = None  # None is a flag for keeping the near-duplicate frames.
 DEFAULT_WORKERS = 0  # 0 is a flag for calculating the number of workers automatically.
+DEFAULT_JOBS = 0  # 0 is a flag for calculating the number of ffmpeg jobs automatically.
+DEFAULT_PARALLELISM = 1
+DEFAULT_TIMEOUT = 0.0  # 0 is a flag for waiting for the ffmpeg processes without a time limit.
+DEFAULT_RETRIES = 2
+DEFAULT_THREADS = 0  # 0 is a flag for splitting the cores by the ffmpeg jobs automatically.
+DEFAULT_SCALER = None  # None is a flag for choosing the scaler by the downscale ratio.
+DEFAULT_LOWRES = None  # None is a flag for choosing the lowres level by the downscale ratio.
+DEFAULT_PROCESSES = False
+DEFAULT_CACHE = None
+DEFAULT_MEMORY = 0  # 0 is a flag for admitting the videos without a memory budget.
+DEFAULT_CACHE_SIZE = 1024  # The size limit of the cache in megabytes.
+DEFAULT_MANIFEST = None
+DEFAULT_QUEUE = None  # None is a flag for processing the inputs without sharing them with other nodes.
+DEFAULT_EXTENSIONS = None  # None is a flag for accepting any extension except the generated ones.
+DEFAULT_INCLUDE = ()
+DEFAULT_EXCLUDE = ()
+DEFAULT_METRICS = None
+DEFAULT_PROMETHEUS = None
+DEFAULT_FAILURES = None
+DEFAULT_PROGRESS = "detailed"
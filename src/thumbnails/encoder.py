@@ -0,0 +1,75 @@
+def register_encoder(typename, extension, feature=None, lossless=False):
+    """Register a new image format into the encoder.
+
+    :param feature:
+        The Pillow feature required by the format, it is checked once the format is used,
+        so Pillow is not imported until an image is encoded.
+
+    :param lossless:
+        Whether the images are encoded without a loss, so they can be decoded and encoded again.
+    """
+
+    def _register_format(func):
+        Encoder.formats[typename] = extension, func, feature, lossless
+        return func
+
+    return _register_format
+
+
+class Encoder:
+    """This class saves the thumbnail images in the given format and quality."""
+
+    formats = {}
+
+    def __init__(self, fmt, quality):
+        if fmt not in self.formats:
+            raise ValueError("The image format '%s' is not registered." % fmt)
+        if not self.supported(fmt):
+            raise ValueError("The image format '%s' is not supported by the installed Pillow." % fmt)
+        if quality < 1 or quality > 100:
+            raise ValueError("Quality must be between 1 and 100.")
+
+        self.format = fmt
+        self.quality = quality
+        self.extension, self._options, _, self.lossless = self.formats[fmt]
+
+    @classmethod
+    def supported(cls, fmt):
+        """Checks whether the Pillow feature required by the format is available."""
+        feature = cls.formats[fmt][2]
+        if feature is None:
+            return True
+
+        from PIL import features
+
+        return features.check(feature)
+
+    def save(self, image, fp):
+        """Saves the image in the format to the given path or file object."""
+        image.save(fp, **self._options(self.quality))
+
+    @classmethod
+    def extensions(cls):
+        """Returns the extensions of all the registered formats."""
+        return sorted({extension for extension, *_ in cls.formats.values()})
+
+
+@register_encoder("png", "png", lossless=True)
+def _png(_):
+    # PNG is lossless, so the quality is ignored.
+    return {"format": "PNG"}
+
+
+@register_encoder("jpeg", "jpg")
+def _jpeg(quality):
+    return {"format": "JPEG", "quality": quality, "optimize": True, "progressive": True}
+
+
+@register_encoder("webp", "webp", feature="webp")
+def _webp(quality):
+    return {"format": "WEBP", "quality": quality, "method": 4}
+
+
+@register_encoder("avif", "avif", feature="avif")
+def _avif(quality):
+    return {"format": "AVIF", "quality": quality}
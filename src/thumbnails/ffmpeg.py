@@ -1,18 +1,98 @@
+import functools
 import os
 import re
 import subprocess
 
-from imageio.v3 import immeta
-from imageio_ffmpeg import get_ffmpeg_exe
+from .scheduler import Scheduler
 
-ffmpeg_bin = get_ffmpeg_exe()
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_bin():
+    """Resolves the path of the ffmpeg binary on the first use and caches it.
+
+    The heavy dependencies of probing (av, imageio) are imported on the first use as well, so the
+    CLI starts quickly when there is nothing to process (e.g. printing the help, skipping the videos).
+    """
+    from imageio_ffmpeg import get_ffmpeg_exe
+
+    return get_ffmpeg_exe()
+
+
+def probe(filepath, cache=None, keyframes=False, metrics=None, scheduler=None):
+    """Probes the metadata of a video file, the cached metadata is used if possible.
+
+    The metadata is a dict of the duration, size, rotation, sample aspect ratio (sar)
+    and keyframe times of the video. The keyframes are None unless they are requested.
+    The spawned ffmpeg processes are held in the budget of the scheduler, if any.
+    """
+    fingerprint = cache.fingerprint(filepath) if cache else None
+    metadata = cache.load(fingerprint, "probe.json") if cache else None
+
+    if metadata is None or keyframes and metadata["keyframes"] is None:
+        if metadata is None:
+            metadata = _FFMpeg._probe(filepath, metrics, scheduler)
+        if keyframes:
+            metadata["keyframes"] = _FFMpeg._parse_keyframes(filepath)
+        if cache:
+            cache.store(fingerprint, "probe.json", metadata)
+
+    return dict(metadata, fingerprint=fingerprint)
 
 
 class _FFMpeg:
     """This class is used to parse the metadata of a video file."""
 
-    def __init__(self, filepath):
-        self.duration, self.size = self._parse_metadata(filepath)
+    def __init__(self, filepath, cache=None, metadata=None, metrics=None):
+        self.cache = cache
+        self.metadata = metadata or probe(filepath, cache, metrics=metrics)
+        self.fingerprint = self.metadata["fingerprint"]
+        self.duration = self.metadata["duration"]
+        self.size = self._display_size(self.metadata)
+
+    @staticmethod
+    def _display_size(metadata):
+        """Calculates the size of the frames as they are displayed."""
+        (width, height), (num, den) = metadata["size"], metadata["sar"]
+        width = round(width * num / den)
+        if metadata["rotation"] % 180:
+            return height, width
+        return width, height
+
+    @classmethod
+    def _probe(cls, filepath, metrics=None, scheduler=None):
+        """Probe the metadata of a video file in-process, falls back to ffmpeg if fails."""
+        import av
+
+        try:
+            with av.open(filepath) as container:
+                stream = container.streams.video[0]
+                duration = container.duration and container.duration / av.time_base
+                if not duration and stream.duration:
+                    duration = float(stream.duration * stream.time_base)
+                rotation = stream.metadata.get("rotate")
+                if rotation is None:
+                    # Newer ffmpeg versions provide the rotation only as the side data of the frames,
+                    # which is not exposed by the older PyAV versions, so it is parsed by ffmpeg then.
+                    frame = next(container.decode(stream), None)
+                    rotation = frame.rotation if hasattr(frame, "rotation") else None
+                sar = stream.sample_aspect_ratio or 1
+                size = stream.width, stream.height
+        except (av.error.FFmpegError, IndexError):
+            duration = None
+
+        if not duration or not all(size):
+            duration, size = cls._parse_metadata(filepath, metrics, scheduler)
+            rotation, sar = 0, 1
+        elif rotation is None:
+            rotation = cls._parse_rotation(cls._run_info(filepath, metrics, scheduler))
+
+        return {
+            "duration": duration,
+            "size": list(size),
+            "rotation": round(float(rotation)),
+            "sar": [sar.numerator, sar.denominator],
+            "keyframes": None,
+        }
 
     @staticmethod
     def _parse_duration(stdout):
@@ -22,6 +102,12 @@ class _FFMpeg:
         time = (float(part.replace(",", ".")) for part in time.split(":"))
         return sum(mult * part for mult, part in zip((3600, 60, 1), time))
 
+    @staticmethod
+    def _parse_rotation(stdout):
+        """Parse the rotation of a video from the display matrix in stdout."""
+        match_rotation = re.search(r"displaymatrix: rotation of (-?[\d.]+) degrees", stdout)
+        return float(match_rotation.group(1)) if match_rotation else 0
+
     @staticmethod
     def _parse_size(stdout):
         """Parse the size of a video from stdout."""
@@ -29,8 +115,31 @@ class _FFMpeg:
         match_size = re.search(size_regex, stdout, re.M)
         return tuple(map(int, match_size.groups()))
 
-    def _parse_metadata(self, filepath):
+    @staticmethod
+    def _parse_keyframes(filepath):
+        """Parse the presentation times of the keyframes of a video."""
+        import av
+
+        with av.open(filepath) as container:
+            stream = container.streams.video[0]
+            start = stream.start_time or 0
+            return sorted(
+                float((packet.pts - start) * stream.time_base)
+                for packet in container.demux(stream)
+                if packet.is_keyframe and packet.pts is not None
+            )
+
+    def _load_keyframes(self, filepath):
+        """Loads the keyframe times of a video from the metadata or probes them."""
+        if self.metadata["keyframes"] is None:
+            self.metadata = probe(filepath, self.cache, keyframes=True)
+        return self.metadata["keyframes"]
+
+    @classmethod
+    def _parse_metadata(cls, filepath, metrics=None, scheduler=None):
         """Parse the metadata of a video file."""
+        from imageio.v3 import immeta
+
         meta = immeta(filepath)
         duration, size = meta.get("duration"), meta.get("size")
 
@@ -38,8 +147,18 @@ class _FFMpeg:
             # Parse the metadata of the video formats
             # that are not supported by imageio.
 
+            stdout = cls._run_info(filepath, metrics, scheduler)
+            duration = cls._parse_duration(stdout)
+            size = cls._parse_size(stdout)
+
+        return duration, size
+
+    @staticmethod
+    def _run_info(filepath, metrics=None, scheduler=None):
+        """Run ffmpeg for printing the information of a video file and return its output."""
+        with (scheduler or Scheduler()).slot(metrics):
             process = subprocess.Popen(
-                (ffmpeg_bin, "-hide_banner", "-i", filepath),
+                (ffmpeg_bin(), "-hide_banner", "-i", filepath),
                 bufsize=100000,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
@@ -47,9 +166,4 @@ class _FFMpeg:
                 creationflags=0x08000000 if os.name == "nt" else 0,
             )
             _, stderr = process.communicate()
-            stdout = (stderr or b"").decode("utf8", errors="ignore")
-
-            duration = self._parse_duration(stdout)
-            size = self._parse_size(stdout)
-
-        return duration, size
+        return (stderr or b"").decode("utf8", errors="ignore")
@@ -12,10 +12,6 @@ class _Frame:
         self._min_width = 30
         self._min_height = math.ceil(self._min_width * self._height / self._width)
 
-        # Maximum size of the frame
-        self._max_width = 7680 // self.columns_count  # 7680 is the width of 8K
-        self._max_height = math.ceil(self._max_width * self._height / self._width)
-
         # Final size of the frame
         self._final_width = None
         self._final_height = None
@@ -35,6 +31,16 @@ class _Frame:
         """Defines an interface for the columns_count property."""
         raise NotImplementedError
 
+    @property
+    def _max_width(self):
+        """Calculates the maximum width of the frame, the layout is calculated only once it is needed."""
+        return 7680 // self.columns_count  # 7680 is the width of 8K
+
+    @property
+    def _max_height(self):
+        """Calculates the maximum height of the frame."""
+        return math.ceil(self._max_width * self._height / self._width)
+
     @property
     def width(self):
         """Calculates and caches the frame width."""
@@ -1,44 +1,134 @@
 import concurrent.futures
 import functools
 import itertools
+import multiprocessing
 import os
-import re
+import subprocess
+import threading
+import time
 
+from .cache import Cache
+from .canvas import Canvas
+from .constants import DEFAULT_APPEND
 from .constants import DEFAULT_BASE
+from .constants import DEFAULT_CACHE
+from .constants import DEFAULT_CACHE_SIZE
+from .constants import DEFAULT_CANVAS
 from .constants import DEFAULT_COMPRESS
+from .constants import DEFAULT_DEDUP
+from .constants import DEFAULT_EXCLUDE
+from .constants import DEFAULT_EXTENSIONS
+from .constants import DEFAULT_FAILURES
 from .constants import DEFAULT_FORMAT
+from .constants import DEFAULT_IMAGE_FORMAT
+from .constants import DEFAULT_INCLUDE
 from .constants import DEFAULT_INTERVAL
+from .constants import DEFAULT_JOBS
+from .constants import DEFAULT_KEYFRAMES
+from .constants import DEFAULT_LOWRES
+from .constants import DEFAULT_MANIFEST
+from .constants import DEFAULT_MAX_FRAMES
+from .constants import DEFAULT_MEMORY
+from .constants import DEFAULT_METRICS
 from .constants import DEFAULT_OUTPUT
+from .constants import DEFAULT_PARALLELISM
+from .constants import DEFAULT_PROCESSES
+from .constants import DEFAULT_PROGRESS
+from .constants import DEFAULT_PROMETHEUS
+from .constants import DEFAULT_QUALITY
+from .constants import DEFAULT_QUEUE
+from .constants import DEFAULT_RETRIES
+from .constants import DEFAULT_SCALER
+from .constants import DEFAULT_SCENE
+from .constants import DEFAULT_SHEET
 from .constants import DEFAULT_SKIP
+from .constants import DEFAULT_THREADS
+from .constants import DEFAULT_TIMEOUT
 from .constants import DEFAULT_WORKERS
-from .pathtools import listdir
-from .progress import use_progress
+from .encoder import Encoder
+from .ffmpeg import probe
+from .manifest import DONE
+from .manifest import PROBED
+from .manifest import WRITTEN
+from .manifest import JobManifest
+from .metrics import JSONLinesExporter
+from .metrics import Metrics
+from .metrics import PrometheusExporter
+from .pathtools import discover
+from .pathtools import metadata_path
+from .progress import Progress
+from .result import FailureManifest
+from .result import Result
+from .scheduler import MemoryBudget
+from .scheduler import Scheduler
+from .sink import FileSink
 from .thumbnail import ThumbnailExistsError
 from .thumbnail import ThumbnailFactory
 from .video import Video
+from .workqueue import WorkQueue
+
+
+# The failures worth retrying, the others are caused by the video or the options.
+TRANSIENT_ERRORS = (OSError, subprocess.TimeoutExpired)
+
+# The delay in seconds before the first retry, it is doubled before each next one.
+RETRY_BACKOFF = 1.0
 
 
 class Generator:
     """High-level class for generating thumbnails."""
 
     def __init__(self, inputs):
-        if all(map(os.path.isfile, inputs)):
-            self.inputs = set(map(os.path.abspath, inputs))
-        elif all(map(os.path.isdir, inputs)):
-            self.inputs = set(itertools.chain(*map(listdir, inputs)))
-        else:
+        # The inputs are discovered lazily, so processing starts as soon as the first video is found.
+        self.inputs = tuple(dict.fromkeys(inputs))
+
+        # The kind of the inputs is checked once, as a long list of files is costly to stat.
+        self._files = all(map(os.path.isfile, self.inputs))
+        if not self._files and not all(map(os.path.isdir, self.inputs)):
             exit("Inputs must be all files or all directories.")
 
         self.base = DEFAULT_BASE
         self.skip = DEFAULT_SKIP
+        self.append = DEFAULT_APPEND
         self.output = DEFAULT_OUTPUT
         self.format = DEFAULT_FORMAT
+        self.image_format = DEFAULT_IMAGE_FORMAT
+        self.quality = DEFAULT_QUALITY
+        self.canvas = DEFAULT_CANVAS
         self.compress = DEFAULT_COMPRESS
         self.interval = DEFAULT_INTERVAL
+        self.sheet = DEFAULT_SHEET
+        self.keyframes = DEFAULT_KEYFRAMES
+        self.scene = DEFAULT_SCENE
+        self.max_frames = DEFAULT_MAX_FRAMES
+        self.dedup = DEFAULT_DEDUP
+        self.parallelism = DEFAULT_PARALLELISM
+        self.timeout = DEFAULT_TIMEOUT
+        self.retries = DEFAULT_RETRIES
+        self.scaler = DEFAULT_SCALER
+        self.lowres = DEFAULT_LOWRES
+        self.processes = DEFAULT_PROCESSES
+        self.memory = DEFAULT_MEMORY
+        self.cache = DEFAULT_CACHE
+        self.cache_size = DEFAULT_CACHE_SIZE
+        self.manifest = DEFAULT_MANIFEST
+        self.queue = DEFAULT_QUEUE
+        self.extensions = DEFAULT_EXTENSIONS
+        self.include = DEFAULT_INCLUDE
+        self.exclude = DEFAULT_EXCLUDE
+        self.metrics = DEFAULT_METRICS
+        self.prometheus = DEFAULT_PROMETHEUS
+        self.failures = DEFAULT_FAILURES
+        self.progress = DEFAULT_PROGRESS
+        self.hooks = []  # The callables receiving the Result of every processed video.
+        self.sink = None  # None is a flag for writing the outputs to the filesystem.
+        self.scheduler = None  # None is a flag for creating the budgets of every run by the jobs and memory.
         self._workers = DEFAULT_WORKERS
-
-        # Remove non-video files in case of input directory already contains other generated files.
-        self.inputs = [file for file in self.inputs if re.match(r"^.*\.(?:(?!png|vtt|json).)+$", file)]
+        self._jobs = DEFAULT_JOBS
+        self._threads = DEFAULT_THREADS
+        self._work_queue = None
+        self._probed = iter(())
+        self._scheduler = Scheduler()
 
     @property
     def workers(self):
@@ -46,43 +136,401 @@ class Generator:
         if self._workers > 0:
             return self._workers
         # Limit the auto-calculated workers for super-multicore machines.
-        return min(32, len(self.inputs), (os.cpu_count() or 1) + 4)
+        workers = min(32, (os.cpu_count() or 1) + 4)
+        if self._files:
+            return min(workers, len(self.inputs))
+        return workers
 
     @workers.setter
     def workers(self, value):
         """Sets the number of workers for concurrent processing."""
         self._workers = value
 
+    @property
+    def jobs(self):
+        """Returns the number of ffmpeg processes allowed to run at once."""
+        if self._jobs > 0:
+            return self._jobs
+        return os.cpu_count() or 1
+
+    @jobs.setter
+    def jobs(self, value):
+        """Sets the number of ffmpeg processes allowed to run at once."""
+        self._jobs = value
+
+    @property
+    def threads(self):
+        """Returns the number of decoding threads of an ffmpeg process."""
+        if self._threads > 0:
+            return self._threads
+        if not self._files:
+            # The videos of the directories are discovered lazily, so the processes running at once are unknown
+            # and ffmpeg chooses the threads by itself.
+            return 0
+        # Split the cores by the ffmpeg processes which can actually run at once, so they do not oversubscribe them.
+        processes = min(self.jobs, self.workers * max(1, self.parallelism))
+        return max(1, (os.cpu_count() or 1) // processes)
+
+    @threads.setter
+    def threads(self, value):
+        """Sets the number of decoding threads of an ffmpeg process."""
+        self._threads = value
+
     @staticmethod
-    def worker(video, fmt, base, skip, output):
-        """Executes the required workflows for generating a thumbnail."""
-        try:
-            thumbnail = ThumbnailFactory.create_thumbnail(fmt, video, base, skip, output)
-        except ThumbnailExistsError:
-            return print("Skipping '%s'" % os.path.relpath(video.filepath))
-        thumbnail.prepare_frames()
-        thumbnail.generate()
+    def initializer(budget, memory=None):
+        """Prepares a worker process for sharing the ffmpeg and memory budgets."""
+        Progress.detach()
+        Scheduler.installed = Scheduler(budget, memory)
+
+    @staticmethod
+    def worker(
+            video,
+            fmt,
+            base,
+            skip,
+            output,
+            encoder=None,
+            append=False,
+            sink=None,
+            retries=0,
+            journal=None,
+            canvas=None,
+    ):
+        """Executes the required workflows for generating the thumbnails of a video and returns the result.
+
+        A thumbnail is generated per format and rendition of the video. Unless the frames are deduplicated,
+        cached or appended, the thumbnails share a single extraction pass of the video.
+
+        The transient failures (timeouts and system errors) are retried with an exponential backoff.
+        The completed stages are recorded to the journal of the job if it is given, the frames of a video
+        written by an interrupted job are not extracted again. The processing is admitted once the estimated
+        memory of the thumbnails fits in the memory budget.
+        """
+        if isinstance(video, Result):
+            # The video has been finished before being scheduled, i.e. it failed probing or was done before.
+            if video.skipped:
+                Progress.log("Skipping '%s'" % os.path.relpath(video.filepath))
+            else:
+                Progress.log("Failed '%s': %s" % (os.path.relpath(video.filepath), video.error.splitlines()[0]))
+            return video
+
+        result = Result(video.filepath, video.metrics)
+        formats = (fmt,) if isinstance(fmt, str) else fmt
+
+        for attempt in itertools.count():
+            try:
+                thumbnails = []
+                for rendition, typename in itertools.product((video, *video.renditions), formats):
+                    try:
+                        thumbnails.append(ThumbnailFactory.create_thumbnail(
+                            typename, rendition, base, skip, output, encoder, append, sink, canvas
+                        ))
+                    except ThumbnailExistsError:
+                        continue
+                if not thumbnails:
+                    raise ThumbnailExistsError
+
+                if not video.written:
+                    with video.scheduler.admit(sum(thumbnail.calc_memory() for thumbnail in thumbnails)):
+                        # The scenes are detected by a pass spooling the frames of all the renditions already.
+                        shared = not video.scene and video.dedup is None and not video.cache
+                        shared = shared and not any(thumbnail.previous for thumbnail in thumbnails)
+                        if len(thumbnails) > 1 and shared:
+                            video.share(dict.fromkeys(thumbnail.video for thumbnail in thumbnails))
+                        for thumbnail in thumbnails:
+                            thumbnail.prepare_frames()
+                    if journal is not None:
+                        journal.record(video.filepath, video.fingerprint, WRITTEN, video.metadata)
+                with video.metrics.stage("metadata"):
+                    for thumbnail in thumbnails:
+                        thumbnail.generate()
+                if journal is not None:
+                    journal.record(video.filepath, video.fingerprint, DONE, video.metadata)
+            except ThumbnailExistsError:
+                Progress.log("Skipping '%s'" % os.path.relpath(video.filepath))
+                video.metrics.skipped = True
+            except concurrent.futures.CancelledError:
+                raise
+            except TRANSIENT_ERRORS as error:
+                if attempt < retries:
+                    Progress.log("Retrying '%s': %s" % (os.path.relpath(video.filepath), error))
+                    video.metrics.count("retries")
+                    time.sleep(RETRY_BACKOFF * 2 ** attempt)
+                    continue
+                result.fail(error)
+            except Exception as error:
+                # A broken video must not fail the others, the error is reported by the result.
+                result.fail(error)
+            else:
+                result.cues = [cue for thumbnail in thumbnails for cue in thumbnail.cues]
+                result.outputs = [path for thumbnail in thumbnails for path in thumbnail.outputs]
+
+            if result.error is not None:
+                Progress.log("Failed '%s': %s" % (os.path.relpath(video.filepath), result.error.splitlines()[0]))
+            return result
 
     def __iter__(self):
+        self._probed = self.probe()
         return self
 
     def __next__(self):
-        """Returns the next video to be processed."""
+        """Returns the next video to be processed, or the failed result if it cannot be processed."""
+        filepath, metadata, stage, metrics, error = next(self._probed)
+        result = Result(filepath, metrics)
+
+        if error is not None:
+            # Fail fast, the broken video is not extracted at all.
+            result.fail(error)
+            return result
+
+        if result.skipped:
+            return result
+
+        # The largest rendition decodes the video, the smaller ones are added to it for sharing its frames.
+        video, *renditions = (
+            self.create_video(filepath, compress, metadata, metrics) for compress in self.compressions
+        )
+        for rendition in renditions:
+            video.add_rendition(rendition)
+        video.written = stage == WRITTEN
+        return video
+
+    def create_video(self, filepath, compress, metadata, metrics):
+        """Creates the video of the probed file at the given compression."""
+        return Video(
+            filepath,
+            compress,
+            self.interval,
+            self.keyframes,
+            self.parallelism,
+            self.sheet,
+            self.scene,
+            self.max_frames,
+            self.dedup,
+            self.timeout,
+            self.threads,
+            self.scaler,
+            self.lowres,
+            self.storage,
+            metadata,
+            metrics,
+            self._scheduler,
+        )
+
+    @property
+    def formats(self):
+        """Returns the distinct output formats, a single format is accepted as well."""
+        if isinstance(self.format, str):
+            return (self.format,)
+        return tuple(dict.fromkeys(self.format))
+
+    @property
+    def compressions(self):
+        """Returns the distinct compress coefficients in the descending order, a single one is accepted as well."""
+        if isinstance(self.compress, (int, float)):
+            return (float(self.compress),)
+        return tuple(sorted(set(map(float, self.compress)), reverse=True))
+
+    @property
+    def storage(self):
+        """Returns the cache of the extracted frames and metadata if the directory is set."""
+        if self.cache is not None:
+            return Cache(self.cache, self.cache_size * 1024 * 1024)
+
+    @property
+    def work_queue(self):
+        """Returns the shared work queue if the directory is set, the same instance holds the leases."""
+        if self.queue is None:
+            return None
+        if self._work_queue is None or self._work_queue.directory != os.path.abspath(self.queue):
+            self._work_queue = WorkQueue(self.queue)
+        return self._work_queue
+
+    @property
+    def journal(self):
+        """Returns the manifest of the job if the path is set, it is bound to the options affecting the outputs."""
+        if self.manifest is not None:
+            options = (
+                self.formats, self.image_format, self.quality, self.compressions, self.interval, self.sheet,
+                self.keyframes, self.scene, self.max_frames, self.dedup, self.scaler, self.lowres, self.base,
+                self.output,
+            )
+            return JobManifest(self.manifest, options)
+
+    def executor(self):
+        """Creates the pool of workers sharing a single budget of ffmpeg processes and memory."""
+        if self.processes:
+            context = multiprocessing.get_context()
+            memory = None
+            if self.memory:
+                memory = MemoryBudget(self.memory * 1024 * 1024, context.Condition(), context.Value("q", 0, lock=False))
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=self.initializer,
+                initargs=(context.BoundedSemaphore(self.jobs), memory),
+            )
+        return concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+
+    def memory_budget(self):
+        """Creates the memory budget of the thread workers if the limit is set."""
+        if self.memory:
+            return MemoryBudget(self.memory * 1024 * 1024)
+
+    def prepare_scheduler(self):
+        """Returns the scheduler of the run, the budgets are created by the options unless the scheduler is given.
+
+        The workers of the processes are scheduled by the budgets created for their pool instead.
+        """
+        if self.scheduler is not None:
+            return self.scheduler
+        return Scheduler(threading.BoundedSemaphore(self.jobs), self.memory_budget())
+
+    def probe(self):
+        """This generator function discovers the inputs and probes them concurrently in batches.
+
+        Each batch is probed before its videos are scheduled, while the rest of the inputs are
+        still being discovered. The file path, its metadata, the completed stage of the resumed job, metrics
+        and the error of probing are yielded.
+
+        If the job is resumed, the metadata of the probed videos is reused and the done ones are skipped.
+        """
+        inputs = discover(self.inputs, self.extensions, self.include, self.exclude)
+        cache = self.storage
+        journal = self.journal
+
+        if self.work_queue is not None:
+            # The inputs are shared with the workers of the other nodes, only the leased ones are processed.
+            inputs = self.work_queue.drain(inputs)
+
+        if journal is not None:
+            journal.load()
+
+        def _resume(filepath, metrics):
+            fingerprint = Cache.fingerprint(filepath)
+            stage, metadata = journal.lookup(filepath, fingerprint)
+            if stage == DONE:
+                metrics.skipped = True
+            elif metadata is None:
+                metadata = probe(filepath, cache, self.keyframes, metrics, self._scheduler)
+                journal.record(filepath, fingerprint, PROBED, metadata)
+                stage = PROBED
+            return dict(metadata, fingerprint=fingerprint), stage
+
+        def _probe(filepath):
+            metrics = Metrics(filepath)
+            try:
+                if self.is_up_to_date(filepath):
+                    metrics.skipped = True
+                    return None, None, metrics, None
+                with metrics.stage("probe"):
+                    if journal is not None:
+                        return (*_resume(filepath, metrics), metrics, None)
+                    return probe(filepath, cache, self.keyframes, metrics, self._scheduler), None, metrics, None
+            except Exception as error:
+                return None, None, metrics, error
+
+        with Progress("Probing metadata of the inputs") as progress:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for count in itertools.count(1):
+                    batch = tuple(itertools.islice(inputs, self.jobs * 4))
+                    if not batch:
+                        break
+                    for filepath, probed in zip(batch, executor.map(_probe, batch)):
+                        yield (filepath, *probed)
+                    progress.update("Probed metadata of [bold]%d[/bold] batches" % count)
+
+    def is_up_to_date(self, filepath):
+        """Checks whether the existing outputs of the video are skipped, so it is not even probed.
+
+        The outputs of several renditions are named by their width, so they are checked only once probed.
+        """
+        if not self.skip or len(self.compressions) > 1:
+            return False
+        mtime = os.path.getmtime(filepath)
+        for fmt in self.formats:
+            path = metadata_path(filepath, self.output, fmt)
+            if not os.path.exists(path) or os.path.getmtime(path) < mtime:
+                return False
+        return True
+
+    @staticmethod
+    def report(futures, hooks):
+        """Passes the results of the finished videos to the hooks and returns them."""
+        results = [future.result() for future in futures]
+        for result in results:
+            for hook in hooks:
+                hook(result)
+        return results
+
+    def prepare_worker(self):
+        """Binds the options of the generator to the worker."""
+        # Fail before processing any video if the canvas does not support the image format.
+        Canvas.backend(self.canvas, self.image_format)
+        if self.processes and not isinstance(self.sink or FileSink(), FileSink):
+            # The sink would be copied to every worker process, and the written outputs would be lost.
+            raise ValueError("Only the filesystem can be written by the processes.")
+        return functools.partial(
+            self.worker,
+            fmt=self.formats,
+            base=self.base,
+            skip=self.skip,
+            output=self.output,
+            encoder=Encoder(self.image_format, self.quality),
+            append=self.append,
+            sink=self.sink,
+            retries=self.retries,
+            journal=self.journal,
+            canvas=self.canvas,
+        )
+
+    def prepare_hooks(self):
+        """Returns the hooks and the exporters receiving the results of the processed videos."""
+        hooks = list(self.hooks)
+        if self.metrics is not None:
+            hooks.append(JSONLinesExporter(self.metrics))
+        if self.prometheus is not None:
+            hooks.append(PrometheusExporter(self.prometheus))
+        if self.failures is not None:
+            hooks.append(FailureManifest(self.failures))
+        if self.work_queue is not None:
+            # The job is completed last, so it is redone if any of the hooks above fails.
+            hooks.append(self.work_queue)
+        return hooks
+
+    def results(self):
+        """This generator function yields the results of the videos as they are finished.
+
+        The results are not retained, so the memory stays flat regardless of the number of inputs.
+        """
+        # The progress is started once the results are consumed, it lasts until the last video is finished.
+        Progress.start(self.progress)
         try:
-            return Video(self.inputs.pop(), self.compress, self.interval)
-        except IndexError:
-            raise StopIteration
+            worker = self.prepare_worker()
+            hooks = self.prepare_hooks()
+            self._scheduler = self.prepare_scheduler()
+
+            with self.executor() as executor:
+                # The inputs are processed again while the jobs of the crashed workers of the queue are reclaimed.
+                while True:
+                    pending = set()
+                    for video in self:
+                        # Keep the number of scheduled videos bounded, so the memory stays flat.
+                        if len(pending) >= self.workers * 2:
+                            done, pending = concurrent.futures.wait(
+                                pending, return_when=concurrent.futures.FIRST_COMPLETED
+                            )
+                            yield from self.report(done, hooks)
+                        pending.add(executor.submit(worker, video))
+                    yield from self.report(concurrent.futures.wait(pending).done, hooks)
+                    if self.work_queue is None or not self.work_queue.wait():
+                        break
+
+            if self.storage:
+                self.storage.evict()
+        finally:
+            Progress.stop()
 
-    @use_progress
     def generate(self):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
-            executor.map(
-                functools.partial(
-                    self.worker,
-                    fmt=self.format,
-                    base=self.base,
-                    skip=self.skip,
-                    output=self.output,
-                ),
-                self,
-            )
+        """Generates the thumbnails of all the inputs and returns the results of the videos."""
+        return list(self.results())
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+
+from .cache import Cache
+
+# The stages of a video in the order of their completion.
+PROBED = "probed"
+WRITTEN = "written"
+DONE = "done"
+
+
+class JobManifest:
+    """This class journals the completed stages of the videos, so an interrupted job can be resumed.
+
+    The manifest is a JSON-lines file appended by an entry per completed stage. An entry is valid only
+    for the same content of the video and the same options, otherwise the video is processed again.
+    """
+
+    def __init__(self, path, options):
+        self.path = path
+        self.options = Cache.key(*options)
+        self.entries = {}
+
+    def load(self):
+        """Replays the journal of the previous runs and compacts it, keeping the last entry per video."""
+        try:
+            with open(self.path) as fp:
+                lines = fp.readlines()
+        except FileNotFoundError:
+            return
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The line was torn by the interruption.
+                continue
+            if entry["options"] == self.options:
+                self.entries[entry["filepath"]] = entry
+
+        # The compacted journal replaces the old one atomically, so it is never lost halfway.
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".")
+        with os.fdopen(fd, "w") as fp:
+            fp.writelines(json.dumps(entry) + "\n" for entry in self.entries.values())
+        os.replace(temp, self.path)
+
+    def lookup(self, filepath, fingerprint):
+        """Returns the last completed stage of the video and its metadata, if the video is unchanged."""
+        entry = self.entries.get(filepath)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None, None
+        return entry["stage"], entry["metadata"]
+
+    def record(self, filepath, fingerprint, stage, metadata):
+        """Appends the completed stage of the video to the journal."""
+        entry = {
+            "filepath": filepath,
+            "fingerprint": fingerprint,
+            "options": self.options,
+            "stage": stage,
+            "metadata": metadata,
+        }
+        # A single write of the whole line, so the concurrent workers do not interleave.
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(entry) + "\n")
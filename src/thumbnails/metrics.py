@@ -0,0 +1,92 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Metrics:
+    """This class collects the per-stage timings and the resource counters of a video.
+
+    The stages are probe, extract, stitch, encode and metadata. The counters are the count
+    of ffmpeg spawns, frames and bytes written.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.skipped = False
+        self.stages = collections.Counter()
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        """Excludes the lock, so the metrics can be returned from a worker process."""
+        return {key: value for key, value in self.__dict__.items() if key != "_lock"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _lock=threading.Lock())
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measures the time spent in the stage, accumulated over the repeated calls."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stages[name] += time.perf_counter() - start
+
+    def count(self, name, value=1):
+        """Increments the counter by the given value."""
+        with self._lock:
+            self.counters[name] += value
+
+    def as_dict(self):
+        """Returns the metrics as a JSON-serializable dict."""
+        return {
+            "filepath": self.filepath,
+            "skipped": self.skipped,
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+        }
+
+
+class JSONLinesExporter:
+    """This hook appends the metrics of every processed video to a JSON-lines file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, result):
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(result.metrics.as_dict()) + "\n")
+
+
+class PrometheusExporter:
+    """This hook keeps the aggregated metrics in a Prometheus text file (e.g. for node_exporter)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.videos = collections.Counter()
+        self.stages = collections.Counter()
+        self.counters = collections.Counter()
+
+    def __call__(self, result):
+        metrics = result.metrics
+        self.videos["failed" if result.error else "skipped" if metrics.skipped else "processed"] += 1
+        self.stages.update(metrics.stages)
+        self.counters.update(metrics.counters)
+
+        lines = ["# TYPE thumbnails_videos_total counter"]
+        lines.extend('thumbnails_videos_total{status="%s"} %d' % item for item in sorted(self.videos.items()))
+        lines.append("# TYPE thumbnails_stage_seconds_total counter")
+        lines.extend('thumbnails_stage_seconds_total{stage="%s"} %f' % item for item in sorted(self.stages.items()))
+        for name, value in sorted(self.counters.items()):
+            lines.append("# TYPE thumbnails_%s_total counter" % name)
+            lines.append("thumbnails_%s_total %d" % (name, value))
+
+        # Replace the file atomically, so the collectors never read a partially written file.
+        with open(self.path + ".tmp", "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+        os.replace(self.path + ".tmp", self.path)
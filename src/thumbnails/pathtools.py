@@ -1,19 +1,69 @@
+import fnmatch
 import os
-from distutils.dir_util import create_tree
+import re
+
+from .encoder import Encoder
 
 
 def listdir(directory):
-    """Lists all files in the given directory with absolute paths."""
-    for basedir, _, files in os.walk(directory):
-        files = [os.path.join(basedir, file) for file in files]
-        for filepath in filter(os.path.isfile, files):
-            yield os.path.abspath(filepath)
+    """Lazily lists all files in the given directory with absolute paths."""
+    stack = [os.path.abspath(directory)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+
+
+def discover(inputs, extensions=None, include=(), exclude=()):
+    """This generator function yields the video files of the inputs as they are found.
+
+    The inputs are files or directories, which are scanned recursively. The glob patterns
+    of include and exclude match either the name or the path relative to the input directory.
+    A file reached by several inputs (e.g. by a relative and an absolute path) is yielded once.
+
+    :param extensions:
+        The allowed extensions. Default is any except the formats of the generated files.
+    """
+    extensions = extensions and {extension.lower().lstrip(".") for extension in extensions}
+    generated = re.compile(r"^.*\.(?:(?!%s).)+$" % "|".join(Encoder.extensions() + ["vtt", "json"]))
+
+    def _matches(filepath, root, patterns):
+        names = (os.path.basename(filepath), os.path.relpath(filepath, root).replace(os.sep, "/"))
+        return any(fnmatch.fnmatch(name, pattern) for name in names for pattern in patterns)
+
+    seen = set()
+    for path in inputs:
+        if os.path.isdir(path):
+            root, files = os.path.abspath(path), listdir(path)
+        else:
+            root, files = os.path.abspath(os.path.dirname(path)), (os.path.abspath(path),)
+
+        for filepath in files:
+            extension = os.path.splitext(filepath)[1][1:].lower()
+            if extensions and extension not in extensions:
+                continue
+            # Skip non-video files in case of input directory already contains other generated files.
+            if not extensions and not generated.match(filepath):
+                continue
+            if include and not _matches(filepath, root, include):
+                continue
+            if exclude and _matches(filepath, root, exclude):
+                continue
+            # The real path tells apart the files, so the duplicates do not write the same outputs at once.
+            realpath = os.path.realpath(filepath)
+            if realpath in seen:
+                continue
+            seen.add(realpath)
+            yield filepath
 
 
-def metadata_path(path, out, fmt):
-    """Calculates the thumbnail metadata output path."""
+def metadata_path(path, out, fmt, suffix=""):
+    """Calculates the thumbnail metadata output path, the name may be suffixed (e.g. by the rendition)."""
     out = os.path.abspath(out or os.path.dirname(path))
-    return os.path.join(out, "%s.%s" % (extract_name(path), fmt))
+    return os.path.join(out, "%s%s.%s" % (extract_name(path), suffix, fmt))
 
 
 def extract_name(path):
@@ -21,10 +71,11 @@ def extract_name(path):
     return os.path.splitext(os.path.basename(path))[0]
 
 
-def ensure_tree(basedir, isdir=False, *args, **kwargs):
+def ensure_tree(basedir, isdir=False):
     """Ensures the existence of basedir and returns."""
-    basedir, file = os.path.abspath(basedir), ""
+    basedir = os.path.abspath(basedir)
     if not isdir:
-        basedir, file = os.path.split(basedir)
-    create_tree(basedir, [file], *args, **kwargs)
+        basedir = os.path.dirname(basedir)
+    # The distutils is not used, its import is costly and it is removed since Python 3.12.
+    os.makedirs(basedir, exist_ok=True)
     return basedir
@@ -1,53 +1,130 @@
+import collections
 import functools
+import time
 
-from rich.progress import Progress as RichProgress
-from rich.progress import SpinnerColumn
-from rich.progress import TextColumn
+# The minimum interval in seconds between two updates of the same task.
+UPDATE_INTERVAL = 0.1
+
+# The rendering modes of the progress.
+MODES = ("detailed", "aggregated", "none")
+
+PROCESSING = " ... [yellow]processing"
+SUCCESS = " ... [green]success"
+FAILURE = " ... [red]failure"
 
 
 class Progress:
+    """Renders the progress of the stages in one of the modes.
+
+    - detailed: Every stage is rendered as a separate task.
+    - aggregated: A single task renders the current stage and the counts of the finished ones.
+    - none: Nothing is rendered, the live display is never started.
+    """
+
+    _mode = "detailed"
     _running = False
-    _instance = RichProgress(SpinnerColumn(finished_text="*"),
-                             TextColumn("[white]{task.description}{task.fields[status]}"))
+    _summary = None
+    _counts = collections.Counter()
+    _instance = None  # The live display is created once it is started.
 
     def __init__(self, description):
+        self._updated = 0.0
+        self.task = None
         if self._running:
-            self.task = self._instance.add_task(description, status=" ... [yellow]processing")
+            if self._mode == "aggregated":
+                self.task = self._summary
+            else:
+                self.task = self._instance.add_task(description, status=PROCESSING)
         self.description = description
 
-    def update(self, description, status=" ... [yellow]processing"):
-        if self._running:
-            self._instance.update(self.task, description=description, status=status, refresh=True)
+    def update(self, description, status=PROCESSING, force=False):
+        # The stage started before the live display is not rendered.
+        if not self._running or self.task is None:
+            return
+
+        # Rate-limit the updates, the display is refreshed by the renderer thread.
+        now = time.monotonic()
+        if not force and now - self._updated < UPDATE_INTERVAL:
+            return
+        self._updated = now
+
+        if self._mode == "aggregated":
+            status = " ... [green]%d succeeded[/green], [red]%d failed" % (
+                self._counts[SUCCESS], self._counts[FAILURE],
+            )
+        self._instance.update(self.task, description=description, status=status)
 
     @classmethod
-    def start(cls):
+    def _create(cls):
+        """Creates the live display, rich is imported only if the progress is rendered."""
+        from rich.progress import Progress as RichProgress
+        from rich.progress import SpinnerColumn
+        from rich.progress import TextColumn
+
+        return RichProgress(SpinnerColumn(finished_text="*"),
+                            TextColumn("[white]{task.description}{task.fields[status]}"))
+
+    @classmethod
+    def start(cls, mode="detailed"):
+        if mode not in MODES:
+            raise ValueError("Progress mode must be one of %s." % ", ".join(MODES))
+        cls._mode = mode
+        if mode == "none":
+            return
+        if cls._instance is None:
+            cls._instance = cls._create()
         cls._running = True
+        cls._counts.clear()
+        if mode == "aggregated":
+            if cls._summary is not None:
+                cls._instance.remove_task(cls._summary)
+            cls._summary = cls._instance.add_task("Starting", status=PROCESSING)
         cls._instance.start()
 
     @classmethod
     def stop(cls):
+        if not cls._running:
+            return
         cls._running = False
         cls._instance.stop()
 
+    @classmethod
+    def detach(cls):
+        """Disables the progress in a worker process inherited the running instance."""
+        cls._running = False
+
+    @classmethod
+    def log(cls, message):
+        """Prints the message above the live display unless the progress is disabled."""
+        if cls._mode == "none":
+            return
+        if cls._running:
+            return cls._instance.console.print(message)
+        print(message)
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, _):
-        # Set finished time to 0 to hide the spinner
-        self._instance.tasks[self.task].finished_time = 0
-        if exc_type is not None:
-            return self.update(exc_val, status=" ... [red]failure")
-        self.update(self.description, status=" ... [green]success")
+        if not self._running or self.task is None:
+            return
+        status = FAILURE if exc_type is not None else SUCCESS
+        if self._mode == "aggregated":
+            self._counts[status] += 1
+        else:
+            # Set finished time to 0 to hide the spinner
+            self._instance.tasks[self.task].finished_time = 0
+        self.update(exc_val if exc_type is not None else self.description, status=status, force=True)
 
 
 def use_progress(func):
-    """Decorator for using the progress bar."""
+    """Decorator for using the progress bar in the mode of the generator."""
 
     @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        Progress.start()
+    def wrapper(self, *args, **kwargs):
+        Progress.start(self.progress)
         try:
-            func(*args, **kwargs)
+            return func(self, *args, **kwargs)
         finally:
             Progress.stop()
 
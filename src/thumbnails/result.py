@@ -0,0 +1,52 @@
+import collections
+import json
+
+# This describes a single thumbnail, the src is the route of the image written to the metadata.
+Cue = collections.namedtuple("Cue", ("start", "end", "src", "x", "y", "width", "height"))
+
+
+class Result:
+    """This class describes the outcome of the thumbnail generation of a video.
+
+    The result holds the cues of the thumbnails, the paths of the written outputs, the metrics
+    of the stages and the error, if the generation has failed.
+    """
+
+    def __init__(self, filepath, metrics):
+        self.filepath = filepath
+        self.metrics = metrics
+        self.cues = []
+        self.outputs = []
+        self.error = None
+
+    @property
+    def skipped(self):
+        return self.metrics.skipped
+
+    def fail(self, error):
+        """Marks the result as failed by the given exception."""
+        self.error = "%s: %s" % (type(error).__name__, error)
+
+    def as_dict(self):
+        """Returns the result as a JSON-serializable dict."""
+        return {
+            "filepath": self.filepath,
+            "skipped": self.skipped,
+            "error": self.error,
+            "outputs": self.outputs,
+            "cues": [cue._asdict() for cue in self.cues],
+            "metrics": self.metrics.as_dict(),
+        }
+
+
+class FailureManifest:
+    """This hook appends the failed videos to a JSON-lines file, so only they can be processed again."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, result):
+        if result.error is None:
+            return
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps({"filepath": result.filepath, "error": result.error}) + "\n")
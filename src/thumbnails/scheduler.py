@@ -0,0 +1,67 @@
+import contextlib
+import threading
+import types
+
+
+class MemoryBudget:
+    """This class admits the videos while their estimated memory fits in the limit in bytes.
+
+    The condition and the counter can be shared by processes, e.g. a multiprocessing
+    Condition and Value, otherwise they are shared by the threads of the process.
+    """
+
+    def __init__(self, limit, condition=None, used=None):
+        self.limit = limit
+        self._condition = condition or threading.Condition()
+        self._used = used if used is not None else types.SimpleNamespace(value=0)
+
+    @contextlib.contextmanager
+    def reserve(self, size):
+        """Waits until the size fits in the budget and holds it while processing."""
+        with self._condition:
+            # A video larger than the whole budget is admitted alone, so it is not starved.
+            self._condition.wait_for(lambda: not self._used.value or self._used.value + size <= self.limit)
+            self._used.value += size
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._used.value -= size
+                self._condition.notify_all()
+
+
+class Scheduler:
+    """This class owns the budget of in-flight ffmpeg processes shared by the videos of a generator.
+
+    It also admits the videos by the budget of memory, if any. A scheduler without budgets only
+    counts the ffmpeg spawns. The same scheduler can be given to several generators for sharing it.
+    """
+
+    installed = None  # The scheduler of a worker process, it is installed by the initializer of the pool.
+
+    def __init__(self, budget=None, memory=None):
+        self.budget = budget
+        self.memory = memory
+
+    @contextlib.contextmanager
+    def slot(self, metrics=None):
+        """Holds a slot of the budget while an ffmpeg process is running."""
+        if metrics is not None:
+            metrics.count("ffmpeg_spawns")
+
+        if self.budget is None:
+            yield
+            return
+
+        with self.budget:
+            yield
+
+    @contextlib.contextmanager
+    def admit(self, size):
+        """Holds the estimated memory of a video while it is processed."""
+        if self.memory is None:
+            yield
+            return
+
+        with self.memory.reserve(size):
+            yield
@@ -0,0 +1,72 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+
+
+class Sink:
+    """Any destination of the generated thumbnails should implement the base Sink.
+
+    The outputs are addressed by the paths they would have in the filesystem.
+    """
+
+    @contextlib.contextmanager
+    def open(self, path):
+        """Opens the output for writing in binary mode."""
+        raise NotImplementedError
+
+    def clear(self, directory):
+        """Removes the previously written outputs in the directory."""
+        raise NotImplementedError
+
+    def directory(self, path):
+        """Returns the absolute path of the output directory, nothing is created outside the filesystem."""
+        return os.path.abspath(path)
+
+
+class FileSink(Sink):
+    """This sink writes the outputs to the filesystem, each output is replaced atomically."""
+
+    @contextlib.contextmanager
+    def open(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                yield fp
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+    def clear(self, directory):
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+
+    def directory(self, path):
+        path = os.path.abspath(path)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+
+class MemorySink(Sink):
+    """This sink keeps the outputs in memory as bytes by their paths.
+
+    The sink is shared by the workers, so it is only usable with the thread workers.
+    """
+
+    def __init__(self):
+        self.files = {}
+
+    @contextlib.contextmanager
+    def open(self, path):
+        with io.BytesIO() as fp:
+            yield fp
+            self.files[path] = fp.getvalue()
+
+    def clear(self, directory):
+        prefix = os.path.join(directory, "")
+        for path in [path for path in self.files if path.startswith(prefix)]:
+            del self.files[path]
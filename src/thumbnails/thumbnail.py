@@ -1,18 +1,25 @@
+import collections
+import contextlib
+import itertools
 import json
 import os
 import pathlib
+import posixpath
+import re
 from abc import ABCMeta
 from abc import abstractmethod
 from datetime import timedelta
-from distutils.dir_util import copy_tree
-from distutils.dir_util import remove_tree
 
-from PIL import Image
-
-from .pathtools import ensure_tree
+from .canvas import Canvas
+from .constants import DEFAULT_CANVAS
+from .constants import DEFAULT_IMAGE_FORMAT
+from .constants import DEFAULT_QUALITY
+from .encoder import Encoder
 from .pathtools import extract_name
 from .pathtools import metadata_path
 from .progress import Progress
+from .result import Cue
+from .sink import FileSink
 
 
 def register_thumbnail(typename):
@@ -29,6 +36,12 @@ def register_thumbnail(typename):
     return _register_factory
 
 
+def format_time(secs):
+    """Formats the offset in seconds as a WebVTT timestamp."""
+    delta = timedelta(seconds=secs)
+    return ("0%s.000" % delta)[:12]
+
+
 class ThumbnailExistsError(Exception):
     """The thumbnail already exists."""
 
@@ -38,36 +51,78 @@ class Thumbnail(metaclass=ABCMeta):
 
     extension = None
 
-    def __init__(self, video, base, skip, output):
+    def __init__(self, video, base, skip, output, encoder=None, append=False, sink=None, canvas=None):
         self.video = video
         self.base = base
         self.skip = skip
         self.output = output
+        self.encoder = encoder or Encoder(DEFAULT_IMAGE_FORMAT, DEFAULT_QUALITY)
+        self.sink = sink or FileSink()
+        self.canvas = canvas or DEFAULT_CANVAS
+        self.cues = []
+        self.outputs = []
         self.thumbnail_dir = self.calc_thumbnail_dir()
         self.metadata_path = self._get_metadata_path()
         self._perform_skip()
+        self.previous = self._load_previous() if append else ()
+
+    def _load_previous(self):
+        """Loads the previously generated frames, which are reused instead of extracting them again.
 
-        with Progress("Extracting the frames by the given interval"):
-            self.extract_frames()
+        Nothing is reused unless the existing metadata matches the leading timestamps and the frame size.
+        """
+        if not os.path.exists(self.metadata_path):
+            return ()
+        try:
+            return self.parse_metadata()
+        except (KeyError, ValueError):
+            return ()
+
+    @property
+    def suffix(self):
+        """Returns the suffix of the output names, the renditions of a video are told apart by their width."""
+        return "-%dw" % self.width if self.rendition else ""
 
     def _get_metadata_path(self):
         """Initiates the name of the thumbnail metadata file."""
-        return metadata_path(self.filepath, self.output, self.extension)
+        return metadata_path(self.filepath, self.output, self.extension, self.suffix)
 
     def _perform_skip(self):
         """Checks the file existence and decide whether to skip or not."""
-        if os.path.exists(self.metadata_path) and self.skip:
-            raise ThumbnailExistsError
-        ensure_tree(self.metadata_path)
+        if self.skip and os.path.exists(self.metadata_path):
+            # Regenerate the thumbnail if the video has been changed since.
+            if os.path.getmtime(self.metadata_path) >= os.path.getmtime(self.filepath):
+                raise ThumbnailExistsError
+        self.sink.directory(os.path.dirname(self.metadata_path))
 
     def __getattr__(self, item):
         """Delegates all other attributes to the video."""
         return getattr(self.video, item)
 
+    @contextlib.contextmanager
+    def write(self, path):
+        """Opens the output for writing to the sink, records it and counts the written bytes."""
+        with self.sink.open(path) as fp:
+            yield fp
+            size = fp.tell()
+        self.outputs.append(path)
+        self.metrics.count("bytes_written", size)
+
     @abstractmethod
     def calc_thumbnail_dir(self):
         """Calculates and returns the thumbnail's output directory."""
 
+    def calc_memory(self):
+        """Estimates the peak memory of the thumbnail in bytes, which is reserved before processing."""
+        return self.width * self.height * 4
+
+    def parse_metadata(self):
+        """Parses the existing metadata and returns the sequence of the generated frames.
+
+        Raises ValueError if the metadata does not match the current video and options.
+        """
+        return ()
+
     @abstractmethod
     def prepare_frames(self):
         """Prepares the thumbnail frames before generating the output."""
@@ -96,45 +151,104 @@ class ThumbnailVTT(Thumbnail):
     """Implements the methods for generating thumbnails in the WebVTT format."""
 
     def calc_thumbnail_dir(self):
-        return ensure_tree(self.output or os.path.dirname(self.filepath), True)
+        return self.sink.directory(self.output or os.path.dirname(self.filepath))
+
+    def sheet_name(self, sheet):
+        """Returns the filename of the sprite sheet, the sheets are numbered only when paging."""
+        suffix = "-%03d" % sheet if self.sheet else ""
+        return "%s%s%s.%s" % (extract_name(self.filepath), self.suffix, suffix, self.encoder.extension)
+
+    def calc_memory(self):
+        memory = Canvas.backend(self.canvas, self.encoder.format).memory(self.sheet_size(), (self.width, self.height))
+        if self.previous and self.encoder.lossless:
+            # The previous sheet is loaded for restoring its frames.
+            memory += self.sheet_size()[0] * self.sheet_size()[1] * 4
+        return super().calc_memory() + memory
+
+    @contextlib.contextmanager
+    def open_sheet(self, sheet):
+        """Opens the canvas of the sprite sheet, which is saved to the thumbnail directory once closed."""
+        master_path = os.path.join(self.thumbnail_dir, self.sheet_name(sheet))
+        backend = Canvas.backend(self.canvas, self.encoder.format)
+        with Progress("Saving the result at '%s'" % master_path), self.write(master_path) as fp:
+            canvas = backend(self.sheet_size(sheet), self.encoder, fp)
+            yield canvas
+            with self.metrics.stage("encode"):
+                canvas.close()
+
+    def parse_metadata(self):
+        with open(self.metadata_path) as fp:
+            cues = re.findall(r"^(\S+) --> \S+\n(.+)#xywh=(\d+),(\d+),(\d+),(\d+)$", fp.read(), re.MULTILINE)
+
+        previous = []
+        for (start, route, x, y, width, height), timestamp in zip(cues, self.timestamps):
+            name = posixpath.basename(route)
+            if start != format_time(timestamp) or (int(width), int(height)) != (self.width, self.height):
+                raise ValueError("The cue at %s does not match the video." % start)
+            if not os.path.exists(os.path.join(self.thumbnail_dir, name)):
+                raise ValueError("The sprite sheet '%s' does not exist." % name)
+            previous.append((name, int(x), int(y)))
+        return previous
+
+    def restore_frame(self, name, x, y):
+        """Crops the previously generated frame from its sprite sheet."""
+        from PIL import Image
+
+        if self._restored[0] != name:
+            # The sheet is fully loaded, as it may be overwritten before the next frames are cropped.
+            with Image.open(os.path.join(self.thumbnail_dir, name)) as image:
+                self._restored = name, image.convert("RGB")
+        return self._restored[1].crop((x, y, x + self.width, y + self.height))
 
     def prepare_frames(self):
-        thumbnails = self.thumbnails(True)
-        master = Image.new(mode="RGBA", size=next(thumbnails))
-        master_path = os.path.join(self.thumbnail_dir, extract_name(self.filepath) + ".png")
-
-        with Progress("Preprocessing the frames before merging") as progress:
-            for frame, *_, x, y in thumbnails:
-                offset = extract_name(frame).replace("-", ":").split(".")[0]
-                progress.update("Processing [bold]%s[/bold] frame" % offset)
-                with Image.open(frame) as image:
-                    master.paste(image, (x, y))
-
-        with Progress("Saving the result at '%s'" % master_path):
-            master.save(master_path)
+        thumbnails = list(self.thumbnails())
+        self._restored = None, None
+
+        # Only the sheets of the new frames or of the moved previous frames are (re)written.
+        dirty = {
+            sheet for n, (*_, x, y, sheet) in enumerate(thumbnails)
+            if n >= len(self.previous) or self.previous[n] != (self.sheet_name(sheet), x, y)
+        }
+
+        # The previous frames of the rewritten sheets are restored only if the format is lossless, as
+        # encoding a lossy sheet again degrades them. Otherwise, they are extracted with the new frames.
+        restored = len(self.previous)
+        if not self.encoder.lossless:
+            restored = min([n for n, (*_, sheet) in enumerate(thumbnails) if sheet in dirty] + [restored])
+        frames = self.extract_frames(restored)
+
+        with Progress("Extracting and merging the frames by the given interval") as progress:
+            for sheet, tiles in itertools.groupby(enumerate(thumbnails), key=lambda tile: tile[1][-1]):
+                if sheet not in dirty:
+                    continue
+                # Only a single sheet is kept open, the filled one is saved right away.
+                with self.open_sheet(sheet) as canvas:
+                    for n, (frame, *_, x, y, _) in tiles:
+                        image = self.restore_frame(*self.previous[n]) if n < restored else next(frames)
+                        offset = extract_name(frame).replace("-", ":").split(".")[0]
+                        progress.update("Processing [bold]%s[/bold] frame" % offset)
+                        with self.metrics.stage("stitch"):
+                            canvas.paste(image, (x, y))
+            # Exhaust the frames, so the extracted ones are committed to the cache.
+            collections.deque(frames, maxlen=0)
 
     def generate(self):
-        def format_time(secs):
-            delta = timedelta(seconds=secs)
-            return ("0%s.000" % delta)[:12]
-
         metadata = ["WEBVTT\n\n"]
         prefix = self.base if self.base is not None else os.path.relpath(self.thumbnail_dir)
-        route = os.path.join(prefix, extract_name(self.filepath) + ".png")
-        route = pathlib.Path(route).as_posix()
 
         with Progress("Saving thumbnail metadata at '%s'" % self.metadata_path):
-            for _, start, end, x, y in self.thumbnails():
+            for _, start, end, x, y, sheet in self.thumbnails():
+                route = os.path.join(prefix, self.sheet_name(sheet))
+                route = pathlib.Path(route).as_posix()
                 thumbnail_data = "%s --> %s\n%s#xywh=%d,%d,%d,%d\n\n" % (
                     format_time(start), format_time(end),
                     route, x, y, self.width, self.height,
                 )
                 metadata.append(thumbnail_data)
+                self.cues.append(Cue(start, end, route, x, y, self.width, self.height))
 
-        with open(self.metadata_path, "w") as fp:
-            fp.writelines(metadata)
-
-        self.tempdir.cleanup()
+        with self.write(self.metadata_path) as fp:
+            fp.write("".join(metadata).encode())
 
 
 @register_thumbnail("json")
@@ -143,20 +257,43 @@ class ThumbnailJSON(Thumbnail):
 
     def calc_thumbnail_dir(self):
         basedir = os.path.abspath(self.output or os.path.dirname(self.filepath))
-        return ensure_tree(os.path.join(basedir, extract_name(self.filepath)), True)
+        return self.sink.directory(os.path.join(basedir, extract_name(self.filepath) + self.suffix))
+
+    def frame_name(self, frame):
+        """Returns the filename of the frame with the extension of the image format."""
+        return "%s.%s" % (os.path.splitext(os.path.basename(frame))[0], self.encoder.extension)
+
+    def parse_metadata(self):
+        with open(self.metadata_path) as fp:
+            metadata = json.load(fp)
+
+        previous = []
+        for (start, data), (frame, timestamp, *_) in zip(metadata.items(), self.thumbnails()):
+            frame = self.frame_name(frame)
+            if start != str(int(timestamp)) or data["width"] != "%spx" % self.width:
+                raise ValueError("The frame at %s does not match the video." % start)
+            if not os.path.exists(os.path.join(self.thumbnail_dir, frame)):
+                raise ValueError("The frame '%s' does not exist." % frame)
+            previous.append(frame)
+        return previous
 
     def prepare_frames(self):
-        with Progress("Copying the frames to the output directory"):
-            if os.path.exists(self.thumbnail_dir):
-                remove_tree(self.thumbnail_dir)
-            copy_tree(self.tempdir.name, self.thumbnail_dir)
+        with Progress("Extracting the frames to the output directory"):
+            if not self.previous:
+                self.sink.clear(self.thumbnail_dir)
+            self.sink.directory(self.thumbnail_dir)
+            thumbnails = itertools.islice(self.thumbnails(), len(self.previous), None)
+            for image, (frame, *_) in zip(self.extract_frames(len(self.previous)), thumbnails):
+                frame = os.path.join(self.thumbnail_dir, self.frame_name(frame))
+                with self.metrics.stage("encode"), self.write(frame) as fp:
+                    self.encoder.save(image, fp)
 
     def generate(self):
         metadata = {}
 
         with Progress("Saving thumbnail metadata at '%s'" % self.metadata_path):
-            for frame, start, *_ in self.thumbnails():
-                frame = os.path.join(self.thumbnail_dir, os.path.basename(frame))
+            for frame, start, end, *_ in self.thumbnails():
+                frame = os.path.join(self.thumbnail_dir, self.frame_name(frame))
                 base = os.path.join(self.base or "", os.path.basename(self.thumbnail_dir))
                 prefix = base if self.base is not None else os.path.relpath(self.thumbnail_dir)
                 route = os.path.join(prefix, os.path.basename(frame))
@@ -166,8 +303,7 @@ class ThumbnailJSON(Thumbnail):
                     "width": "%spx" % self.width,
                 }
                 metadata[int(start)] = thumbnail_data
+                self.cues.append(Cue(start, end, route, 0, 0, self.width, self.height))
 
-        with open(self.metadata_path, "w") as fp:
-            json.dump(metadata, fp, indent=2)
-
-        self.tempdir.cleanup()
+        with self.write(self.metadata_path) as fp:
+            fp.write(json.dumps(metadata, indent=2).encode())
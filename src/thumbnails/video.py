@@ -1,18 +1,29 @@
+import bisect
 import concurrent.futures
-import glob
+import contextlib
+import gzip
+import itertools
 import math
 import os
+import re
 import subprocess
+import tempfile
+import threading
+import zlib
 from datetime import timedelta
-from tempfile import TemporaryDirectory
-
-from imageio_ffmpeg import get_ffmpeg_exe
 
 from .ffmpeg import _FFMpeg
+from .ffmpeg import ffmpeg_bin
 from .frame import _Frame
+from .metrics import Metrics
 from .progress import Progress
+from .scheduler import Scheduler
+
+# The scaling algorithms of ffmpeg suitable for the thumbnails.
+SCALERS = ("fast_bilinear", "bilinear", "bicubic", "area", "lanczos")
 
-ffmpeg_bin = get_ffmpeg_exe()
+# The maximum level of decoding at a lower resolution, i.e. 1/8 of the size.
+MAX_LOWRES = 3
 
 
 def arange(start, stop, step):
@@ -27,25 +38,109 @@ def arange(start, stop, step):
     return tuple(_generator())
 
 
+def dhash(image):
+    """Calculates the 64-bit difference hash of the image, which is tolerant to noise and compression."""
+    from PIL import Image
+
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    bits = (pixels[row * 9 + col] > pixels[row * 9 + col + 1] for row in range(8) for col in range(8))
+    return sum(bit << n for n, bit in enumerate(bits))
+
+
 class Video(_FFMpeg, _Frame):
     """This class gives methods to extract the thumbnail frames of a video."""
 
-    def __init__(self, filepath, compress, interval):
+    def __init__(
+            self,
+            filepath,
+            compress,
+            interval,
+            keyframes=False,
+            parallelism=1,
+            sheet=None,
+            scene=0.0,
+            max_frames=0,
+            dedup=None,
+            timeout=0.0,
+            threads=0,
+            scaler=None,
+            lowres=None,
+            cache=None,
+            metadata=None,
+            metrics=None,
+            scheduler=None,
+    ):
         self.__filepath = filepath
         self.__compress = float(compress)
         self.__interval = float(interval)
+        self.__keyframes = bool(keyframes)
+        self.__parallelism = int(parallelism)
+        self.__sheet = tuple(map(int, sheet)) if sheet else None
+        self.__scene = float(scene)
+        self.__max_frames = int(max_frames)
+        self.__dedup = None if dedup is None else int(dedup)
+        self.__timeout = float(timeout)
+        self.__threads = int(threads)
+        self.__scaler = scaler
+        self.__lowres = None if lowres is None else int(lowres)
 
         if self.__compress < 0 or self.__compress > 1:
             raise ValueError("Compress must be between 0 and 1.")
 
-        self.tempdir = TemporaryDirectory()
-        self.__frames_count = None
+        if self.__parallelism < 1:
+            raise ValueError("Parallelism must be a positive number.")
+
+        if self.__sheet and min(self.__sheet) < 1:
+            raise ValueError("Sheet columns and rows must be positive numbers.")
+
+        if self.__scene < 0 or self.__scene > 1:
+            raise ValueError("Scene threshold must be between 0 and 1.")
+
+        if self.__scene and self.__keyframes:
+            raise ValueError("Scene and keyframe sampling cannot be combined.")
+
+        if self.__dedup is not None and not 0 <= self.__dedup <= 64:
+            raise ValueError("Dedup distance must be between 0 and 64.")
+
+        if self.__timeout < 0:
+            raise ValueError("Timeout must be a non-negative number.")
+
+        if self.__threads < 0:
+            raise ValueError("Threads must be a non-negative number.")
+
+        if self.__scaler is not None and self.__scaler not in SCALERS:
+            raise ValueError("Scaler must be one of %s." % ", ".join(SCALERS))
+
+        if self.__lowres is not None and not 0 <= self.__lowres <= MAX_LOWRES:
+            raise ValueError("Lowres must be between 0 and %d." % MAX_LOWRES)
+
+        self.__timestamps = None
+        self.__scenes = None
         self.__columns = None
+        self.__spool = None
+        self.__scene_spool = None
+        self.__end = None
+        self.__primary = None
+        self.__stacked = None
+        self.__cancelled = False
+        self.__processes = set()
+        self.rendition = False
+        self.renditions = ()
+        self.written = False  # The outputs were written by an interrupted job, only the metadata is left.
+        self.metrics = metrics or Metrics(filepath)
+        self.scheduler = scheduler or Scheduler()
 
         with Progress("Parsing metadata from the video"):
-            _FFMpeg.__init__(self, filepath)
+            _FFMpeg.__init__(self, filepath, cache, metadata, self.metrics)
             _Frame.__init__(self, self.size)
 
+    def __getstate__(self):
+        """Excludes the scheduler, a video sent to a worker process is scheduled by the budgets of the process."""
+        return dict(self.__dict__, scheduler=None)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, scheduler=Scheduler.installed or Scheduler())
+
     @property
     def filepath(self):
         return self.__filepath
@@ -58,12 +153,82 @@ class Video(_FFMpeg, _Frame):
     def interval(self):
         return self.__interval
 
+    @property
+    def keyframes(self):
+        return self.__keyframes
+
+    @property
+    def parallelism(self):
+        return self.__parallelism
+
+    @property
+    def sheet(self):
+        return self.__sheet
+
+    @property
+    def scene(self):
+        return self.__scene
+
+    @property
+    def max_frames(self):
+        return self.__max_frames
+
+    @property
+    def dedup(self):
+        return self.__dedup
+
+    @property
+    def timeout(self):
+        return self.__timeout
+
+    @property
+    def threads(self):
+        return self.__threads
+
+    @property
+    def lowres(self):
+        """Returns the level of decoding at a lower resolution, chosen by the downscale ratio unless set.
+
+        The level is the largest one keeping the decoded frames not smaller than the thumbnails.
+        The decoders not supporting it (e.g. h264) ignore it and decode at the full resolution.
+        """
+        if self.__lowres is not None:
+            return self.__lowres
+        ratio = self._downscale_ratio()
+        return min(MAX_LOWRES, int(math.log2(ratio))) if ratio >= 2 else 0
+
+    @property
+    def scaler(self):
+        """Returns the scaling algorithm, chosen by the downscale ratio left after the decoding unless set.
+
+        Averaging the area is cheaper than bicubic when shrinking by a large factor, and does not alias.
+        """
+        if self.__scaler is not None:
+            return self.__scaler
+        ratio = self._downscale_ratio() / 2 ** self.lowres
+        return "area" if ratio >= 2 else "bicubic"
+
+    @property
+    def scenes(self):
+        """Detects and caches the offsets and scores of the scene changes."""
+        if self.__primary is not None:
+            # The renditions sample the same frames as the video they are added to.
+            return self.__primary.scenes
+        if self.__scenes is None:
+            self.__scenes = self.calc_scenes()
+        return self.__scenes
+
+    @property
+    def timestamps(self):
+        """Calculates and caches the offsets of the frames to be extracted."""
+        if not self.__timestamps:
+            self.__timestamps = self.calc_timestamps()
+        return self.__timestamps
+
     @property
     def frames_count(self):
-        """Calculates and caches the count of frames."""
-        if not self.__frames_count:
-            self.__frames_count = len(arange(0, self.duration, self.interval))
-        return self.__frames_count
+        """Returns the count of frames."""
+        return len(self.timestamps)
 
     @property
     def columns_count(self):
@@ -72,8 +237,164 @@ class Video(_FFMpeg, _Frame):
             self.__columns = self.calc_columns()
         return self.__columns
 
+    @property
+    def sheet_capacity(self):
+        """Returns the maximum count of frames in a single sprite sheet."""
+        if not self.sheet:
+            return max(self.frames_count, 1)
+        return self.columns_count * self.sheet[1]
+
+    @property
+    def sheets_count(self):
+        """Returns the count of sprite sheets."""
+        return math.ceil(self.frames_count / self.sheet_capacity)
+
+    def calc_scenes(self):
+        """Detects the scene changes in a single decoding pass, the first frame always starts a scene.
+
+        The frames starting the scenes are spooled by the same pass for this video and its renditions,
+        before the layout is known. Their size is not capped by the width of the sheet yet, so they are
+        resized once read if the layout caps it. If the scenes are cached, the frames are decoded again.
+        """
+        if self.cache:
+            key = self.cache.key(self.fingerprint, self.scene, self.lowres)
+            scenes = self.cache.load(key, "scenes.json")
+            if scenes is not None:
+                return [tuple(scene) for scene in scenes]
+
+        videos = (self, *self.renditions)
+        sizes = [video._uncapped_size() for video in videos]
+        scales = ["scale=%d:%d:flags=%s" % (*size, video.scaler) for video, size in zip(videos, sizes)]
+        size = max(width for width, _ in sizes), sum(height for _, height in sizes)
+        spools, count = [tempfile.TemporaryFile() for _ in videos], 0
+
+        with tempfile.TemporaryDirectory() as directory:
+            # The scores are printed aside, as the frames are streamed through the pipe.
+            path = os.path.join(directory, "scenes.txt").replace("\\", "/").replace(":", "\\:")
+            vf = "%s,metadata=print:file='%s',%s" % (self._scene_filter(), path, self._stack(scales, size[0]))
+            frames = self._read_frames("-vsync", "passthrough", "-vf", vf, size=size)
+            try:
+                for count, frame in enumerate(frames, 1):
+                    top = 0
+                    for (width, height), spool in zip(sizes, spools):
+                        spool.write(frame.crop((0, top, width, top + height)).tobytes())
+                        top += height
+            finally:
+                frames.close()
+            with open(os.path.join(directory, "scenes.txt")) as fp:
+                pattern = r"pts_time:(\S+)\s+lavfi\.scene_score=(\S+)"
+                scenes = [(float(start), float(score)) for start, score in re.findall(pattern, fp.read())]
+
+        if len(scenes) == count:
+            for video, size, spool in zip(videos, sizes, spools):
+                video.__scene_spool = spool, size
+        if self.cache:
+            self.cache.store(key, "scenes.json", scenes)
+        return scenes
+
+    def _uncapped_size(self):
+        """Returns the size of the frames before the layout, which is capped by the width of the sheet."""
+        width = max(round(self._width * self.compress), self._min_width)
+        height = max(round(self._height * self.compress), self._min_height)
+        return width, height
+
+    def _spooled_scenes(self, timestamps):
+        """This generator function yields the spooled frames of the scenes starting at the given timestamps."""
+        from PIL import Image
+
+        spool, size = self.__scene_spool
+        frame_size = size[0] * size[1] * 3
+        wanted = set(timestamps)
+
+        for n, (start, _) in enumerate(self.scenes):
+            if start not in wanted:
+                continue
+            spool.seek(n * frame_size)
+            frame = Image.frombytes("RGB", size, spool.read(frame_size))
+            if size != (self.width, self.height):
+                frame = frame.resize((self.width, self.height), Image.BICUBIC)
+            yield frame
+
+    def _downscale_ratio(self):
+        """Returns the ratio of the video to the thumbnail size, which does not depend on the frames count.
+
+        The scene detection decodes the same way as the extraction, so it cannot wait for the final size.
+        """
+        return 1 / max(self.compress, self._min_width / self._width)
+
+    def _decode_options(self):
+        """Returns the input options of the decoder, shared by the scene detection and the extraction."""
+        options = ("-lowres", str(self.lowres)) if self.lowres else ()
+        if self.threads:
+            options += ("-threads", str(self.threads))
+        return options
+
+    def _scale_filter(self):
+        """Returns the filter scaling the frames to the thumbnail size by the scaler.
+
+        While the frames are shared, they are split and scaled to every rendition, and the scaled
+        frames are padded to the same width and stacked vertically into a single frame.
+        """
+        if not self.__stacked:
+            return "scale=%d:%d:flags=%s" % (self.width, self.height, self.scaler)
+
+        scales = ["scale=%d:%d:flags=%s" % (video.width, video.height, video.scaler) for video in self.__stacked]
+        return self._stack(scales, self._output_size()[0])
+
+    @staticmethod
+    def _stack(scales, width):
+        """Returns the filter splitting the frames by the scales, padded to the width and stacked vertically."""
+        if len(scales) == 1:
+            return scales[0]
+
+        chains = ";".join("[s%d]%s,pad=%d:ih[o%d]" % (n, scale, width, n) for n, scale in enumerate(scales))
+        inputs, outputs = zip(*(("[s%d]" % n, "[o%d]" % n) for n in range(len(scales))))
+        return "split=%d%s;%s;%svstack=inputs=%d" % (
+            len(scales), "".join(inputs), chains, "".join(outputs), len(scales)
+        )
+
+    def _output_size(self):
+        """Returns the size of the frames emitted by ffmpeg, the stacked frames of the renditions if shared."""
+        if not self.__stacked:
+            return self.width, self.height
+        return max(video.width for video in self.__stacked), sum(video.height for video in self.__stacked)
+
+    def _scene_filter(self):
+        """Returns the filter selecting the first frame and the frames starting a new scene."""
+        return "select=eq(n\\,0)+gt(scene\\,%r)" % self.scene
+
+    def calc_timestamps(self):
+        """Calculates the frame offsets, snapped to the nearest keyframes if requested.
+
+        In the scene sampling mode, the offsets are the scene changes. If there are more of them
+        than the budget of frames allows, the first frame and the strongest changes are kept.
+        """
+        if self.scene:
+            scenes = self.scenes
+            if self.max_frames and len(scenes) > self.max_frames:
+                strongest = sorted(scenes[1:], key=lambda scene: scene[1], reverse=True)
+                scenes = sorted(scenes[:1] + strongest[:self.max_frames - 1])
+            return tuple(start for start, _ in scenes)
+
+        timestamps = tuple(n * self.interval for n in range(len(arange(0, self.duration, self.interval))))
+        keyframes = self._load_keyframes(self.filepath) if self.keyframes else None
+
+        if not keyframes:
+            return timestamps
+
+        snapped = []
+        for timestamp in timestamps:
+            index = bisect.bisect(keyframes, timestamp)
+            nearest = min(keyframes[max(index - 1, 0):index + 1], key=lambda k: abs(k - timestamp))
+            if not snapped or snapped[-1] != nearest:
+                snapped.append(nearest)
+        return tuple(snapped)
+
     def calc_columns(self):
-        """Calculates an optimal number of columns for 16:9 aspect ratio."""
+        """Calculates an optimal number of columns for 16:9 aspect ratio, or the columns of a sheet."""
+        if self.sheet:
+            return max(min(self.sheet[0], self.frames_count), 1)
+
         ratio = 16 / 9
         width, height = self.size
         for col in range(1, self.frames_count):
@@ -81,66 +402,416 @@ class Video(_FFMpeg, _Frame):
                 return col
         return 1  # fixes the case when the video is too short
 
+    def add_rendition(self, video):
+        """Adds a rendition of the same file at another compression, whose frames can be shared with this video.
+
+        The rendition is decoded the same way and samples the same frames, and both are named by their width.
+        As the layout is calculated lazily, nothing of the rendition is sampled before it is added.
+        """
+        video.__primary = self
+        video.__lowres = self.lowres
+        video.rendition = self.rendition = True
+        self.renditions += (video,)
+
+    def cancel(self):
+        """Cancels the processing of the video and its renditions, the running ffmpeg processes are killed."""
+        self.__cancelled = True
+        for process in list(self.__processes):
+            process.kill()
+        for video in self.renditions:
+            video.cancel()
+
+    def _watch(self, process, activity, expired):
+        """Kills the process once it has not emitted a frame for the timeout, i.e. it is stalled."""
+        while process.poll() is None:
+            if not activity.wait(self.timeout):
+                expired.set()
+                process.kill()
+                return
+            activity.clear()
+
+    def _read_frames(self, *options, input_options=(), size=None):
+        """This generator function decodes the video and yields the raw RGB frames from a pipe.
+
+        The frames are of the output size unless the size is given.
+
+        Raises subprocess.TimeoutExpired if ffmpeg is stalled for the timeout, and
+        subprocess.CalledProcessError if it fails before emitting any frame.
+        """
+        from PIL import Image
+
+        size = size or self._output_size()
+        frame_size = size[0] * size[1] * 3
+
+        if self.__cancelled:
+            raise concurrent.futures.CancelledError
+
+        with self.scheduler.slot(self.metrics):
+            process = subprocess.Popen(
+                (
+                    ffmpeg_bin(),
+                    *self._decode_options(),
+                    *input_options,
+                    "-i", self.filepath,
+                    "-loglevel", "error",
+                    "-an", "-sn",
+                    *options,
+                    "-f", "rawvideo",
+                    "-pix_fmt", "rgb24",
+                    "-",
+                ),
+                bufsize=frame_size,
+                stdout=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+            )
+            self.__processes.add(process)
+            activity, expired = threading.Event(), threading.Event()
+            if self.timeout:
+                threading.Thread(target=self._watch, args=(process, activity, expired), daemon=True).start()
+
+            try:
+                for count in itertools.count():
+                    data = process.stdout.read(frame_size)
+                    activity.set()
+                    if self.__cancelled:
+                        raise concurrent.futures.CancelledError
+                    if expired.is_set():
+                        raise subprocess.TimeoutExpired(process.args, self.timeout)
+                    if len(data) < frame_size:
+                        # A failed ffmpeg is reported only if nothing was decoded, as the damaged
+                        # tail of a video (e.g. a growing recording) should not fail its frames.
+                        if process.wait() and not count:
+                            raise subprocess.CalledProcessError(process.returncode, process.args)
+                        break
+                    yield Image.frombytes("RGB", size, data)
+            finally:
+                activity.set()
+                self.__processes.discard(process)
+                process.stdout.close()
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+
+    def _read_segment(self, timestamps, *options):
+        """This generator function decodes only the part of the video covering the given timestamps."""
+        input_options = (
+            "-ss", str(timedelta(seconds=timestamps[0])),
+            "-t", str(timedelta(seconds=len(timestamps) * self.interval)),
+        )
+        reader = self._read_frames(*options, input_options=input_options)
+        try:
+            yield from itertools.islice(reader, len(timestamps))
+        finally:
+            reader.close()
+
+    def _read_segments(self, timestamps, *options):
+        """This generator function decodes the segments of the video concurrently and yields their frames.
+
+        The frames of a segment are spooled to a temporary file until its turn, so only a single frame
+        is kept in memory per segment.
+        """
+        from PIL import Image
+
+        size = math.ceil(len(timestamps) / self.parallelism)
+        segments = [timestamps[i:i + size] for i in range(0, len(timestamps), size)]
+        width, height = self._output_size()
+        frame_size = width * height * 3
+
+        def _decode(segment):
+            spool, count = tempfile.TemporaryFile(), 0
+            for frame in self._read_segment(segment, *options):
+                spool.write(frame.tobytes())
+                count += 1
+            # Fall back to seeking for the frames the segment could not emit.
+            for start_time in segment[count:]:
+                spool.write(self._extract_frame(start_time).tobytes())
+            spool.seek(0)
+            return spool
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            for segment, spool in zip(segments, executor.map(_decode, segments)):
+                with spool:
+                    for _ in segment:
+                        yield Image.frombytes("RGB", (width, height), spool.read(frame_size))
+
     def _extract_frame(self, start_time):
         """Extracts a single frame from the video by the offset."""
+        from PIL import Image
+
         offset = str(timedelta(seconds=start_time))
-        filename = "%s.png" % offset.replace(":", "-")
-        output = os.path.join(self.tempdir.name, filename)
-        os.close(os.open(output, os.O_CREAT, mode=0o664))
-
-        ffmpeg_options = (
-            "-i", self.filepath,
-            "-loglevel", "error",
-            "-vframes", "1",
-            "-vf", "scale=%d:%d" % (self.width, self.height),
-            output,
-            "-y",
-        )
+        scale = self._scale_filter()
 
-        subprocess.Popen((ffmpeg_bin, "-ss", offset, *ffmpeg_options)).wait()
+        error = None
 
-        if os.stat(output).st_size == 0:
-            # Check if the frame is empty. If so, try to extract it again with a smaller offset.
+        for input_options in (("-ss", offset), ("-sseof", "-0.1")):
+            # If the frame is empty, try to extract it again with a smaller offset.
             # This handles the case when ffmpeg cannot extract the last frame of the video.
-            subprocess.Popen((ffmpeg_bin, "-sseof", "-0.1", *ffmpeg_options)).wait()
+            try:
+                for frame in self._read_frames("-vframes", "1", "-vf", scale, input_options=input_options):
+                    return frame
+            except subprocess.CalledProcessError as exc:
+                error = exc
+
+        # A black frame is used only if ffmpeg succeeded but had nothing to emit.
+        if error is not None:
+            raise error
+        return Image.new("RGB", self._output_size())
+
+    def extract_frames(self, offset=0):
+        """This generator function yields the frames of the video in the order of the timestamps.
+
+        The frames are loaded from the cache if possible, otherwise they are extracted and cached.
+
+        :param offset:
+            The count of the leading timestamps to be skipped. Default is 0.
+        """
+        if self.dedup is not None or self.__spool is not None:
+            frames = self._spooled_frames(offset)
+        else:
+            frames = self._cached_frames(offset) if self.cache else self._extract_frames(offset)
+
+        try:
+            while True:
+                with self.metrics.stage("extract"):
+                    frame = next(frames, None)
+                if frame is None:
+                    return
+                self.metrics.count("frames")
+                yield frame
+        finally:
+            frames.close()
+
+    def _deduplicate(self):
+        """Extracts the frames and collapses the consecutive near-duplicates into the first of them.
+
+        A frame is a near-duplicate if the Hamming distance between its perceptual hash and the hash of
+        the kept one does not exceed the dedup distance. The kept frames are spooled to a temporary file,
+        and the timestamps and the layout are recalculated for them.
+        """
+        if self.__spool is not None:
+            return
+
+        frames = self._cached_frames() if self.cache else self._extract_frames()
+        spool, timestamps, last = tempfile.TemporaryFile(), [], None
+
+        try:
+            for start in self.timestamps:
+                with self.metrics.stage("extract"):
+                    frame = next(frames)
+                with self.metrics.stage("dedup"):
+                    digest = dhash(frame)
+                if last is not None and bin(last ^ digest).count("1") <= self.dedup:
+                    self.metrics.count("duplicates")
+                    continue
+                spool.write(frame.tobytes())
+                timestamps.append(start)
+                last = digest
+        finally:
+            frames.close()
+
+        # The last kept frame also stands for the collapsed frames till the end.
+        self.__end = self.calc_end(self.timestamps[-1])
+        self.__timestamps = tuple(timestamps)
+        self.__columns = None
+        self.__spool = spool
 
-    def extract_frames(self):
-        """Extracts the frames from the video by given intervals."""
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            executor.map(self._extract_frame, arange(0, self.duration, self.interval))
+    def share(self, videos):
+        """Extracts the frames of the given renditions in a single pass of this video, and spools them.
+
+        The decoded frames are split and scaled to every rendition in ffmpeg, and stacked into a single
+        frame of the pass. The spooled frames are read by all the thumbnails of a rendition without
+        decoding the video again. The renditions should sample the same frames, i.e. not deduplicated.
+        """
+        videos = tuple(videos)
+        spools = [tempfile.TemporaryFile() for _ in videos]
+        self.__stacked = videos
+        frames = self._extract_frames()
+
+        try:
+            for _ in self.timestamps:
+                with self.metrics.stage("extract"):
+                    frame = next(frames)
+                top = 0
+                for video, spool in zip(videos, spools):
+                    spool.write(frame.crop((0, top, video.width, top + video.height)).tobytes())
+                    top += video.height
+        finally:
+            frames.close()
+            self.__stacked = None
+
+        for video, spool in zip(videos, spools):
+            video.__spool = spool
+
+    def _spooled_frames(self, offset=0):
+        """This generator function yields the deduplicated or shared frames of the video from the spool."""
+        from PIL import Image
+
+        self._deduplicate()
+        size = self.width, self.height
+        frame_size = self.width * self.height * 3
+
+        self.__spool.seek(offset * frame_size)
+        for _ in self.timestamps[offset:]:
+            yield Image.frombytes("RGB", size, self.__spool.read(frame_size))
+
+    def _cached_frames(self, offset=0):
+        """This generator function yields the cached frames of the video or extracts and caches them."""
+        from PIL import Image
+
+        size = self.width, self.height
+        frame_size = self.width * self.height * 3
+        timestamps = self.timestamps[offset:]
+        key = self.cache.key(self.fingerprint, size, timestamps, self.lowres, self.scaler)
+        cached = 0
+
+        # The raw frames are compressed, so the entries of long videos fit the size limit of the cache.
+        with self.cache.open(key, "frames.raw.gz") as fp:
+            if fp:
+                with contextlib.suppress(EOFError, OSError, zlib.error), gzip.GzipFile(fileobj=fp) as stream:
+                    for _ in timestamps:
+                        data = stream.read(frame_size)
+                        if len(data) < frame_size:
+                            break
+                        yield Image.frombytes("RGB", size, data)
+                        cached += 1
+
+        if cached == len(timestamps):
+            return
+        if cached:
+            # The entry is damaged, the rest of its frames is extracted again.
+            yield from self._extract_frames(offset + cached)
+            return
+
+        with self.cache.create(key, "frames.raw.gz") as fp:
+            with gzip.GzipFile(fileobj=fp, mode="wb", compresslevel=1) as stream:
+                for frame in self._extract_frames(offset):
+                    stream.write(frame.tobytes())
+                    yield frame
+
+    def _read_keyframes(self, timestamps, scale):
+        """This generator function decodes only the keyframes and yields the ones at the given timestamps.
+
+        The decoded frames are matched to the keyframe index by their order. The decoders ignoring the
+        skipping of the other frames (e.g. VP9) have them dropped by their key flag. If the count of the
+        decoded keyframes still differs from the index, their order cannot be trusted and nothing is
+        yielded, so the frames are extracted by seeking instead.
+        """
+        from PIL import Image
+
+        wanted = set(timestamps)
+        keyframes = self._load_keyframes(self.filepath)
+        size = self._output_size()
+        frame_size = size[0] * size[1] * 3
+        spool, count = tempfile.TemporaryFile(), 0
+
+        with spool:
+            # The wanted frames are spooled, as the order is verified only once all the keyframes are decoded.
+            frames = self._read_frames(
+                "-vsync", "passthrough", "-vf", "select=eq(key\\,1),%s" % scale,
+                input_options=("-skip_frame", "nokey"),
+            )
+            try:
+                for count, frame in enumerate(frames, 1):
+                    if count <= len(keyframes) and keyframes[count - 1] in wanted:
+                        wanted.discard(keyframes[count - 1])
+                        spool.write(frame.tobytes())
+            finally:
+                frames.close()
+
+            if count != len(keyframes):
+                self.metrics.count("keyframe_mismatches")
+                return
+
+            spool.seek(0)
+            for _ in range(len(timestamps) - len(wanted)):
+                yield Image.frombytes("RGB", size, spool.read(frame_size))
+
+    def _extract_frames(self, offset=0):
+        """This generator function yields the frames of the video extracted in a single ffmpeg pass.
+
+        The frames are decoded to raw RGB and streamed through a pipe, in the order of the timestamps.
+        The skipped leading timestamps are not decoded, the pass starts by seeking to the first one.
+        In the scene mode the frames are read from the spool of the scene detection. Unless they are
+        spooled (i.e. the scenes are cached), the scene and keyframe modes decode the video from the start
+        regardless, as the frames are matched to the scenes or the keyframes by their order.
+        """
+        scale = self._scale_filter()
+        timestamps = self.timestamps[offset:]
+
+        if not timestamps:
+            return
+
+        if self.scene and self.__scene_spool is not None:
+            frames = self._spooled_scenes(timestamps)
+        elif self.scene:
+            wanted = set(timestamps)
+            frames = self._read_frames("-vsync", "passthrough", "-vf", "%s,%s" % (self._scene_filter(), scale))
+            frames = (frame for frame, (start, _) in zip(frames, self.scenes) if start in wanted)
+        elif self.keyframes:
+            frames = self._read_keyframes(timestamps, scale)
+        else:
+            options = ("-vf", "fps=1/%r:round=up:eof_action=pass,%s" % (self.interval, scale))
+            if self.parallelism > 1:
+                frames = self._read_segments(timestamps, *options)
+            elif offset:
+                frames = self._read_segment(timestamps, *options)
+            else:
+                frames = self._read_frames(*options)
+
+        try:
+            for start_time in timestamps:
+                frame = next(frames, None)
+                if frame is None:
+                    # Fall back to seeking for the frames the single pass could not emit.
+                    frame = self._extract_frame(start_time)
+                yield frame
+        finally:
+            frames.close()
+
+    def calc_end(self, start):
+        """Calculates the end point of the time range the last frame belongs to."""
+        if self.scene:
+            # The last scene lasts until the end of the video.
+            return max(self.duration, start)
+        return start + self.interval
+
+    def sheet_size(self, index=0):
+        """Calculates the size of the sprite sheet by its index."""
+        frames = min(self.frames_count - index * self.sheet_capacity, self.sheet_capacity)
+        return (
+            self.width * self.columns_count,
+            self.height * math.ceil(frames / self.columns_count)
+        )
 
     def thumbnails(self, master_size=False):
         """This generator function yields a thumbnail data on each iteration.
 
         The thumbnail data is a tuple of fields describing the current frame.
-        The structure of the thumbnail data is (frame, start, end, x, y).
-            - frame: The filename of the current frame (usually in temp-files).
+        The structure of the thumbnail data is (frame, start, end, x, y, sheet).
+            - frame: The filename of the current frame, named by its offset.
             - start: The start point of the time range the frame belongs to.
             - end: The end point of the time range the frame belongs to.
-            - x: The X coordinate of the frame in the final image.
-            - y: The Y coordinate of the frame in the final image.
+            - x: The X coordinate of the frame in its sprite sheet.
+            - y: The Y coordinate of the frame in its sprite sheet.
+            - sheet: The index of the sprite sheet the frame belongs to.
 
         :param master_size:
-            If True, the master size will be yielded on the first iteration. Default is False.
+            If True, the size of the first sheet will be yielded on the first iteration. Default is False.
         """
-        line, column = 0, 0
-        frames = sorted(glob.glob(self.tempdir.name + os.sep + "*.png"))
+        if self.dedup is not None:
+            self._deduplicate()
 
         if master_size:
-            yield (
-                self.width * self.columns_count,
-                self.height * math.ceil(self.frames_count / self.columns_count)
-            )
+            yield self.sheet_size()
 
-        for n, frame in enumerate(frames):
+        for n, start in enumerate(self.timestamps):
+            sheet, position = divmod(n, self.sheet_capacity)
+            line, column = divmod(position, self.columns_count)
             x, y = self.width * column, self.height * line
 
-            start = n * self.interval
-            end = (n + 1) * self.interval
-            yield frame, start, end, x, y
-
-            column += 1
-
-            if column == self.columns_count:
-                line += 1
-                column = 0
+            frame = "%s.png" % str(timedelta(seconds=start)).replace(":", "-")
+            if n + 1 < self.frames_count:
+                end = self.timestamps[n + 1]
+            else:
+                end = self.calc_end(start) if self.__end is None else self.__end
+            yield frame, start, end, x, y, sheet
@@ -0,0 +1,166 @@
+import hashlib
+import itertools
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+# The seconds a lease stays valid without a heartbeat of its worker.
+LEASE_TIMEOUT = 60.0
+
+# The seconds a worker waits for the leases of the others before checking them again.
+POLL_INTERVAL = 1.0
+
+# The count of the inputs enqueued before every lease while draining.
+DRAIN_BATCH = 16
+
+
+class WorkQueue:
+    """This class gives a queue of videos in a shared directory, so the workers of many nodes share a job.
+
+    The jobs are files moved between the pending, leased, done and failed subdirectories. A job is leased
+    by an atomic rename, so it is taken by a single worker. Every enqueued job is marked in the enqueued
+    subdirectory, so it is never enqueued twice. The leases are kept alive by the heartbeats
+    of their worker, and the expired leases of the crashed workers are reclaimed by the others.
+    """
+
+    def __init__(self, directory, lease_timeout=LEASE_TIMEOUT):
+        self.directory = os.path.abspath(directory)
+        self.lease_timeout = lease_timeout
+        self.worker_id = "%s-%d-%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._held = set()
+        self._lock = threading.Lock()
+        self._beating = False
+
+        for state in ("enqueued", "pending", "leased", "done", "failed"):
+            os.makedirs(os.path.join(self.directory, state), exist_ok=True)
+
+    def _path(self, state, name):
+        return os.path.join(self.directory, state, name)
+
+    @staticmethod
+    def job_name(filepath):
+        """Returns the name of the job of the video, the same on all the nodes."""
+        return hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()
+
+    def _owned(self, name):
+        """Returns the name of the job leased by this worker."""
+        return "%s.%s" % (name, self.worker_id)
+
+    def put(self, filepath):
+        """Adds the video to the queue unless it is already there, returns whether it is added."""
+        name = self.job_name(filepath)
+        try:
+            # The marker is created exclusively, so a job enqueued by several nodes at once is added by one.
+            os.close(os.open(self._path("enqueued", name), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+
+        # The job is written aside and moved in, so a worker never reads it half-written.
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix=".")
+        with os.fdopen(fd, "w") as fp:
+            fp.write(os.path.abspath(filepath))
+        os.replace(temp, self._path("pending", name))
+        return True
+
+    def lease(self):
+        """Leases a pending job and returns its video, or None if there are no pending jobs."""
+        names = os.listdir(self._path("pending", ""))
+        # The workers try the jobs in different orders, so they rarely race for the same one.
+        random.shuffle(names)
+
+        for name in names:
+            leased = self._path("leased", self._owned(name))
+            try:
+                # The mtime of the job is the last heartbeat, it is renewed before the lease starts.
+                os.utime(self._path("pending", name))
+                os.rename(self._path("pending", name), leased)
+            except FileNotFoundError:
+                continue  # The job was leased by another worker.
+
+            with open(leased) as fp:
+                filepath = fp.read()
+            with self._lock:
+                self._held.add(name)
+                if not self._beating:
+                    self._beating = True
+                    threading.Thread(target=self._heartbeat, daemon=True).start()
+            return filepath
+
+    def _heartbeat(self):
+        """Renews the leases of this worker until it holds none."""
+        while True:
+            time.sleep(self.lease_timeout / 4)
+            with self._lock:
+                if not self._held:
+                    self._beating = False
+                    return
+                for name in self._held:
+                    try:
+                        os.utime(self._path("leased", self._owned(name)))
+                    except FileNotFoundError:
+                        pass  # The lease has expired and been reclaimed.
+
+    def reclaim(self):
+        """Returns the expired leases of the crashed or stalled workers to the pending jobs, and counts them."""
+        now, count = time.time(), 0
+        for leased in os.listdir(self._path("leased", "")):
+            try:
+                if now - os.path.getmtime(self._path("leased", leased)) > self.lease_timeout:
+                    os.rename(self._path("leased", leased), self._path("pending", leased.partition(".")[0]))
+                    count += 1
+            except FileNotFoundError:
+                continue  # The job was finished or reclaimed meanwhile.
+        return count
+
+    def complete(self, filepath, error=None):
+        """Reports the job of the video as done, or as failed by the error."""
+        name = self.job_name(filepath)
+        leased = self._path("leased", self._owned(name))
+
+        with self._lock:
+            self._held.discard(name)
+        try:
+            if error is not None:
+                with open(leased, "a") as fp:
+                    fp.write("\n" + error)
+            os.rename(leased, self._path("failed" if error is not None else "done", name))
+        except FileNotFoundError:
+            pass  # The lease was lost, the job is done again by another worker.
+
+    def __call__(self, result):
+        """Completes the job as a hook receiving the result of the video."""
+        self.complete(result.filepath, result.error)
+
+    def drain(self, inputs):
+        """This generator function enqueues the inputs and yields the leased videos until nothing is pending.
+
+        A lease follows every batch of the enqueued inputs, so the processing starts before all of them are found.
+        """
+        inputs = iter(inputs)
+        while True:
+            enqueued = 0
+            for filepath in itertools.islice(inputs, DRAIN_BATCH):
+                self.put(filepath)
+                enqueued += 1
+            filepath = self.lease()
+            if filepath is not None:
+                yield filepath
+            elif not enqueued:
+                return
+
+    def wait(self):
+        """Waits until the leases of the other workers are finished, returns whether there are pending jobs again.
+
+        This worker should have completed its own jobs, as it holds no leases meanwhile. The jobs of the
+        crashed workers are pending again once their leases expire.
+        """
+        while True:
+            if self.reclaim() or os.listdir(self._path("pending", "")):
+                return True
+            if not os.listdir(self._path("leased", "")):
+                return False
+            time.sleep(POLL_INTERVAL)
@@ -1,7 +1,37 @@
+import asyncio
+import gc
+import io
+import json
 import os
 import pathlib
+import shutil
+import subprocess
+import sys
+import time
 
+import pytest
+from PIL import Image
+from PIL import ImageChops
+from PIL import ImageStat
+
+from thumbnails import AsyncGenerator
 from thumbnails import Generator
+from thumbnails import MemorySink
+from thumbnails import Scheduler
+from thumbnails import WorkQueue
+from thumbnails.cache import Cache
+from thumbnails.ffmpeg import _FFMpeg
+from thumbnails.ffmpeg import ffmpeg_bin
+from thumbnails.progress import Progress
+from thumbnails.thumbnail import ThumbnailVTT
+from thumbnails.video import Video
+
+
+def synthesize(path, *options, size="320x240", duration=6):
+    """Generates a synthetic test video with the ffmpeg binary bundled by imageio-ffmpeg."""
+    source = "testsrc2=size=%s:rate=25:duration=%d" % (size, duration)
+    subprocess.check_call((ffmpeg_bin(), "-loglevel", "error", "-f", "lavfi", "-i", source, *options, path, "-y"))
+    return path
 
 
 def thumbnail_generation_with_default_output(tmp_media, inputs, fmt):
@@ -82,3 +112,701 @@ def test_api_json_generation_with_extras(tmp_media):
     inputs = (os.path.join(tmp_media, "avi"), os.path.join(tmp_media, "ogv"))
     thumbnail_generation_with_with_extras(tmp_media, inputs, "json", "", "specified-empty-base-")
     thumbnail_generation_with_with_extras(tmp_media, inputs, "json", "/media/thumbnails/", "specified-base-")
+
+
+def test_api_vtt_generation_with_cache(tmp_media):
+    inputs = (os.path.join(tmp_media, "avi"), os.path.join(tmp_media, "ogv"))
+    cache = os.path.join(tmp_media, "cache")
+    results = []
+
+    for _ in range(2):
+        generator = Generator(inputs)
+        generator.cache = cache
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.generate()
+
+        with open(os.path.join(tmp_media, "avi", "video.png"), "rb") as fp:
+            results.append(fp.read())
+
+    # Two metadata and two frame entries, one per video.
+    assert len(os.listdir(cache)) == 4
+
+    # The frames are stored compressed.
+    frames = [os.path.join(cache, entry, "frames.raw.gz") for entry in os.listdir(cache)]
+    sizes = [os.path.getsize(path) for path in frames if os.path.exists(path)]
+    assert len(sizes) == 2 and all(size < 11 * generator.compress ** 2 * 2560 * 1072 * 3 / 2 for size in sizes)
+    assert results[0] == results[1]
+
+
+def test_api_cache_evicted_while_written(tmp_media):
+    cache = Cache(os.path.join(tmp_media, "cache"), 1000)
+    for n in range(50):
+        cache.store(Cache.key(n), "data.json", "x" * 98)
+
+    # The cache is kept bounded during the writes, not only once the run is finished.
+    entries = os.listdir(cache.directory)
+    assert sum(os.path.getsize(os.path.join(cache.directory, entry, "data.json")) for entry in entries) <= 1100
+    assert cache.load(Cache.key(49), "data.json") == "x" * 98
+
+
+def test_api_cache_entries_written_or_oversized(tmp_media):
+    cache = Cache(os.path.join(tmp_media, "cache"), 1000)
+    cache.store(Cache.key(0), "data.json", "x" * 98)
+
+    # The entry being written is not removed by the eviction of another thread.
+    with cache.create(Cache.key(1), "data.json") as fp:
+        fp.write(json.dumps("x" * 898).encode())
+        Cache(cache.directory, 0).evict()
+    assert os.listdir(cache.directory) == [Cache.key(1)]
+
+    # The entry exceeding the size limit is not committed, so it evicts nothing.
+    cache.store(Cache.key(2), "data.json", "x" * 2000)
+    assert cache.load(Cache.key(1), "data.json") is not None
+    assert cache.load(Cache.key(2), "data.json") is None
+
+    # The failed write is discarded even if its entry was removed meanwhile.
+    with pytest.raises(ValueError):
+        with cache.create(Cache.key(3), "data.json"):
+            shutil.rmtree(os.path.join(cache.directory, Cache.key(3)))
+            raise ValueError
+
+
+def test_api_generation_display_geometry(tmp_media, monkeypatch):
+    plain = synthesize(os.path.join(tmp_media, "plain.mp4"), "-c:v", "libx264")
+    anamorphic = synthesize(os.path.join(tmp_media, "anamorphic.mp4"), "-c:v", "libx264", "-vf", "setsar=2/1")
+    rotated = os.path.join(tmp_media, "rotated.mp4")
+    subprocess.check_call(
+        (ffmpeg_bin(), "-loglevel", "error", "-display_rotation", "90", "-i", plain, "-c", "copy", rotated)
+    )
+
+    def generate(path):
+        generator = Generator((path,))
+        generator.compress = 0.5
+        generator.interval = 1
+        generator.cache = os.path.join(tmp_media, "cache")
+        generator.sink = MemorySink()
+        result, = generator.generate()
+        sheet, = (output for output in result.outputs if output.endswith(".png"))
+        with Image.open(io.BytesIO(generator.sink.files[sheet])) as image:
+            return result.cues[0], image.convert("RGB").crop((0, 0, result.cues[0].width, result.cues[0].height))
+
+    plain_cue, plain_tile = generate(plain)
+
+    # The anamorphic pixels are stretched to the display aspect ratio.
+    cue, _ = generate(anamorphic)
+    assert (cue.width, cue.height) == (plain_cue.width * 2, plain_cue.height)
+
+    # The rotated frames are displayed upright.
+    cue, tile = generate(rotated)
+    assert (cue.width, cue.height) == (plain_cue.height, plain_cue.width)
+    difference = ImageChops.difference(tile, plain_tile.transpose(Image.ROTATE_90))
+    assert max(ImageStat.Stat(difference).mean) < 20
+
+    # The rotation is parsed from ffmpeg if the frames of PyAV do not provide it.
+    with monkeypatch.context() as patch:
+        import av
+
+        class Container:
+            def __init__(self, container):
+                self.container = container
+
+            def __enter__(self):
+                self.container.__enter__()
+                return self
+
+            def __exit__(self, *args):
+                return self.container.__exit__(*args)
+
+            def __getattr__(self, name):
+                return getattr(self.container, name)
+
+            def decode(self, *args):
+                return (object() for _ in self.container.decode(*args))
+
+        patch.setattr(av, "open", lambda *args, open=av.open: Container(open(*args)))
+        assert _FFMpeg._probe(rotated)["rotation"] % 180 == 90
+
+    # The probed geometry is reused from the cache.
+    monkeypatch.setattr(_FFMpeg, "_probe", lambda *args, **kwargs: pytest.fail("The video is probed again."))
+    cue, _ = generate(rotated)
+    assert (cue.width, cue.height) == (plain_cue.height, plain_cue.width)
+
+
+def test_api_inputs_checked_once(tmp_media, monkeypatch):
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"), os.path.join(tmp_media, "ogv", "video.ogv")))
+    monkeypatch.setattr(os.path, "isfile", lambda path: pytest.fail("The inputs are checked again."))
+    # The workers are calculated per scheduled video, so they must not stat all the inputs.
+    assert generator.workers == min(2, os.cpu_count() + 4)
+
+
+def test_api_duplicate_inputs_processed_once(tmp_media):
+    filepath = os.path.join(tmp_media, "avi", "video.avi")
+    inputs = (filepath, os.path.relpath(filepath), os.path.join(tmp_media, "avi", ".", "video.avi"))
+
+    generator = Generator(inputs)
+    generator.compress = 0.1
+    generator.interval = 10
+    assert len(generator.generate()) == 1
+
+    # The file reached by both a directory and its path is processed once too.
+    generator = Generator((tmp_media, os.path.join(tmp_media, "avi")))
+    generator.compress = 0.1
+    generator.interval = 10
+    generator.skip = True
+    assert sorted(os.path.basename(result.filepath) for result in generator.generate()) == ["video.avi", "video.ogv"]
+
+
+def test_api_generation_hooks(tmp_media):
+    inputs = (os.path.join(tmp_media, "avi"), os.path.join(tmp_media, "ogv"))
+    results = []
+
+    generator = Generator(inputs)
+    generator.compress = 0.1
+    generator.interval = 10
+    generator.hooks.append(results.append)
+    generator.generate()
+
+    assert len(results) == 2
+    for result in results:
+        assert result.metrics.counters["frames"] == 11
+        assert result.metrics.counters["ffmpeg_spawns"] >= 1
+        assert set(result.metrics.stages) == {"probe", "extract", "stitch", "encode", "metadata"}
+
+
+def test_api_generation_results_streamed(tmp_media):
+    inputs = (os.path.join(tmp_media, "avi"), os.path.join(tmp_media, "ogv"))
+    hooked = []
+
+    generator = Generator(inputs)
+    generator.compress = 0.1
+    generator.interval = 10
+    generator.hooks.append(hooked.append)
+    results = generator.results()
+
+    # Every result is yielded once it is passed to the hooks, not after the whole batch is finished.
+    assert next(results) in hooked
+    assert next(results) in hooked
+    assert next(results, None) is None
+    assert len(hooked) == 2
+
+
+def test_api_vtt_generation_with_sheets(tmp_media):
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.compress = 0.1
+    generator.interval = 10
+    generator.sheet = (3, 2)
+    generator.generate()
+
+    # Eleven frames are paged into two sheets of at most six frames.
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video-000.png"))
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video-001.png"))
+    assert not os.path.exists(os.path.join(tmp_media, "avi", "video-002.png"))
+
+    with open(os.path.join(tmp_media, "avi", "video.vtt")) as fp:
+        metadata = fp.read()
+    assert metadata.count("video-000.png#") == 6
+    assert metadata.count("video-001.png#xywh=0,0,") == 1
+
+
+def test_api_generation_with_image_format(tmp_media):
+    for fmt in ("vtt", "json"):
+        generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+        generator.format = fmt
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.image_format = "jpeg"
+        generator.quality = 60
+        generator.generate()
+
+    with open(os.path.join(tmp_media, "avi", "video.vtt")) as fp:
+        assert "video.jpg#xywh=" in fp.read()
+    with open(os.path.join(tmp_media, "avi", "video.json")) as fp:
+        assert json.load(fp)["0"]["src"].endswith("0-00-00.jpg")
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video", "0-00-00.jpg"))
+
+
+def test_api_vtt_generation_append(tmp_media):
+    results = []
+
+    for _ in range(2):
+        generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.append = True
+        generator.hooks.append(results.append)
+        generator.generate()
+
+    # The second run reuses all the frames of the existing sprite.
+    assert results[0].metrics.counters["frames"] == 11
+    assert results[1].metrics.counters["frames"] == 0
+    assert results[1].metrics.counters["ffmpeg_spawns"] == 0
+
+
+def test_api_vtt_generation_append_lossy(tmp_media):
+    output = os.path.join(tmp_media, "thumbnails")
+
+    def generate(sheet):
+        generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.image_format = "jpeg"
+        generator.sheet = sheet
+        generator.output = output
+        generator.append = True
+        result, = generator.generate()
+        return result
+
+    def truncate(count):
+        # The video is grown by the frames of the truncated cues.
+        with open(os.path.join(output, "video.vtt")) as fp:
+            cues = fp.read().split("\n\n")
+        with open(os.path.join(output, "video.vtt"), "w") as fp:
+            fp.write("\n\n".join(cues[:len(cues) - 1 - count]) + "\n\n")
+
+    # Only the sheet of the new frames is written, the full sheets are neither restored nor encoded again.
+    generate((2, 2))
+    truncate(3)
+    result = generate((2, 2))
+    assert result.metrics.counters["frames"] == 3
+    assert [os.path.basename(path) for path in result.outputs] == ["video-002.jpg", "video.vtt"]
+
+    # The previous frames of a rewritten lossy sheet are extracted again instead of restored.
+    generate(None)
+    truncate(3)
+    assert generate(None).metrics.counters["frames"] == 11
+
+
+def test_api_vtt_generation_by_scenes(tmp_media):
+    results = []
+
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.compress = 0.1
+    generator.scene = 0.003
+    generator.max_frames = 5
+    generator.hooks.append(results.append)
+    generator.generate()
+
+    with open(os.path.join(tmp_media, "avi", "video.vtt")) as fp:
+        metadata = fp.read()
+    assert results[0].metrics.counters["frames"] == 5
+    assert results[0].metrics.counters["ffmpeg_spawns"] == 1
+    assert metadata.count("#xywh=") == 5
+    assert metadata.startswith("WEBVTT\n\n00:00:00.000 --> ")
+
+
+def test_api_scene_detection_deferred_to_worker(tmp_media):
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.compress = 0.1
+    generator.scene = 0.3
+    video = next(iter(generator))
+
+    # The scheduling of a video does not detect its scenes, they are detected once the worker lays it out.
+    assert "ffmpeg_spawns" not in video.metrics.counters
+    assert video.frames_count >= 1
+    assert video.metrics.counters["ffmpeg_spawns"] == 1
+
+
+def test_api_vtt_generation_with_dedup(tmp_media):
+    results = []
+
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.compress = 0.1
+    generator.interval = 5
+    generator.dedup = 64
+    generator.hooks.append(results.append)
+    generator.generate()
+
+    # All the frames are collapsed into the first one, which covers the whole video.
+    with open(os.path.join(tmp_media, "avi", "video.vtt")) as fp:
+        metadata = fp.read()
+    assert results[0].metrics.counters["frames"] == 1
+    assert results[0].metrics.counters["duplicates"] == 20
+    assert "00:00:00.000 --> 00:01:45.000\n" in metadata
+
+
+def test_api_generation_progress_mode(tmp_media):
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.progress = "quiet"
+    with pytest.raises(ValueError):
+        generator.generate()
+    assert not os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))
+
+
+def test_api_generation_progress_rendered(tmp_media, monkeypatch):
+    tasks = []
+    init = Progress.__init__
+
+    def record(self, description):
+        init(self, description)
+        tasks.append((description, self.task))
+
+    monkeypatch.setattr(Progress, "__init__", record)
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.compress = 0.1
+    generator.interval = 10
+    generator.progress = "detailed"
+    generator.generate()
+
+    # The stages of the processed video are rendered while the progress is running.
+    assert any(task is not None for description, task in tasks if description.startswith("Extracting"))
+    assert not Progress._running
+
+
+def test_api_async_generation(tmp_media):
+    inputs = (os.path.join(tmp_media, "avi"), os.path.join(tmp_media, "ogv"))
+
+    async def generate():
+        generator = AsyncGenerator(inputs)
+        generator.compress = 0.1
+        generator.interval = 10
+        return await generator.generate()
+
+    results = asyncio.run(generate())
+    assert sorted(os.path.basename(result.filepath) for result in results) == ["video.avi", "video.ogv"]
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))
+
+
+def test_api_generation_owns_scheduler(tmp_media):
+    class CountingBudget:
+        count = 0
+
+        def __enter__(self):
+            self.count += 1
+
+        def __exit__(self, *_):
+            pass
+
+    def generate(memory=0, scheduler=None):
+        generator = AsyncGenerator((os.path.join(tmp_media, "avi", "video.avi"),))
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.memory = memory
+        generator.scheduler = scheduler
+        result, = asyncio.run(generator.generate())
+        return generator, result
+
+    # The budgets of a generator do not outlive it, the next one creates its own.
+    assert generate(memory=512)[0]._scheduler.memory.limit == 512 * 1024 * 1024
+    assert generate(memory=0)[0]._scheduler.memory is None
+
+    # The given scheduler is shared by all the ffmpeg processes of the generator.
+    budget = CountingBudget()
+    _, result = generate(scheduler=Scheduler(budget))
+    assert result.error is None
+    assert budget.count == result.metrics.counters["ffmpeg_spawns"] >= 1
+
+
+def test_api_async_generation_cancel(tmp_media):
+    broken = os.path.join(tmp_media, "broken.avi")
+    with open(broken, "w") as fp:
+        fp.write("not a video")
+
+    async def generate():
+        generator = AsyncGenerator((broken, os.path.join(tmp_media, "avi", "video.avi")))
+        generator.interval = 0.1
+        worker = generator.prepare_worker()
+        # The failed result of the broken video is still pending once the task is cancelled.
+        generator.prepare_worker = lambda: lambda video: time.sleep(2) or worker(video)
+        task = asyncio.create_task(generator.generate())
+        await asyncio.sleep(1)
+        task.cancel()
+        await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(generate())
+    assert not os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))
+
+
+def test_api_generation_results_to_memory(tmp_media):
+    sink = MemorySink()
+
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.compress = 0.1
+    generator.interval = 10
+    generator.sink = sink
+    result, = generator.generate()
+
+    # Nothing is written to the filesystem, the outputs are kept by the sink.
+    assert not os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))
+    assert sorted(map(os.path.basename, result.outputs)) == ["video.png", "video.vtt"]
+    assert sink.files[result.outputs[-1]].startswith(b"WEBVTT")
+    assert len(result.cues) == 11
+    assert result.cues[1].start == 10 and result.cues[1].x == result.cues[1].width
+    assert result.error is None
+
+    # No directory of the outputs is created on the filesystem.
+    generator.format = "json"
+    generator.output = os.path.join(tmp_media, "memory")
+    result, = generator.generate()
+    assert result.error is None and len(result.outputs) == 12
+    assert not os.path.exists(generator.output)
+
+    # The outputs written to the memory of the worker processes would be lost.
+    generator.processes = True
+    with pytest.raises(ValueError):
+        generator.generate()
+
+
+def test_api_generation_isolates_failures(tmp_media):
+    broken = os.path.join(tmp_media, "avi", "broken.avi")
+    failures = os.path.join(tmp_media, "failures.jsonl")
+    with open(broken, "wb") as fp:
+        fp.write(os.urandom(4096))
+
+    generator = Generator((os.path.join(tmp_media, "avi"),))
+    generator.compress = 0.1
+    generator.interval = 10
+    generator.timeout = 30
+    generator.failures = failures
+    results = {os.path.basename(result.filepath): result for result in generator.generate()}
+
+    # The broken video fails alone, the manifest lists it for resuming.
+    assert results["broken.avi"].error is not None
+    assert results["video.avi"].error is None and len(results["video.avi"].cues) == 11
+    with open(failures) as fp:
+        manifest = [json.loads(line) for line in fp]
+    assert [entry["filepath"] for entry in manifest] == [broken]
+
+
+def test_api_generation_resumes_from_manifest(tmp_media):
+    inputs = (os.path.join(tmp_media, "avi"), os.path.join(tmp_media, "ogv"))
+    manifest = os.path.join(tmp_media, "manifest.jsonl")
+
+    def generate():
+        generator = Generator(inputs)
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.manifest = manifest
+        return generator.generate()
+
+    assert not any(result.skipped for result in generate())
+    with open(manifest) as fp:
+        stages = [json.loads(line)["stage"] for line in fp]
+    assert sorted(stages) == ["done", "done", "probed", "probed", "written", "written"]
+
+    # The done videos are skipped, the changed ones are processed again.
+    os.utime(os.path.join(tmp_media, "ogv", "video.ogv"))
+    results = {os.path.basename(result.filepath): result for result in generate()}
+    assert results["video.avi"].skipped and not results["video.ogv"].skipped
+    assert results["video.ogv"].error is None
+
+
+def test_api_generation_resumes_written_outputs(tmp_media, monkeypatch):
+    manifest = os.path.join(tmp_media, "manifest.jsonl")
+    generate = ThumbnailVTT.generate
+
+    def interrupted(self):
+        raise RuntimeError("Interrupted")
+
+    def run():
+        generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.manifest = manifest
+        return generator.generate()
+
+    # The job is interrupted once the sprite sheet is written, but the metadata is not.
+    monkeypatch.setattr(ThumbnailVTT, "generate", interrupted)
+    result, = run()
+    assert result.error is not None
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video.png"))
+    assert not os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))
+
+    # The resumed job writes only the metadata, the frames are not extracted again.
+    monkeypatch.setattr(ThumbnailVTT, "generate", generate)
+    result, = run()
+    assert result.error is None and len(result.cues) == 11
+    assert "ffmpeg_spawns" not in result.metrics.counters
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))
+
+
+def test_api_generation_decoding_knobs(tmp_media, monkeypatch):
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.compress = 0.1
+    generator.interval = 10
+    generator.jobs = 1
+    video = next(iter(generator))
+
+    # The 10x downscale is mostly done by the decoder, the rest by the precise scaler.
+    assert video.threads == os.cpu_count()
+    assert (video.lowres, video.scaler) == (3, "bicubic")
+
+    # A single video does not run more processes than its segments, whatever the jobs are.
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "cpu_count", lambda: 8)
+        generator.jobs = 0
+        generator.parallelism = 2
+        assert generator.threads == 4
+        generator.parallelism = 1
+
+        # The videos of the directories are not known in advance, so ffmpeg chooses the threads.
+        assert Generator((os.path.join(tmp_media, "avi"),)).threads == 0
+
+    generator.lowres = 0
+    generator.scaler = "fast_bilinear"
+    generator.sink = MemorySink()
+    result, = generator.generate()
+    assert result.error is None and len(result.cues) == 11
+
+
+def test_api_generation_with_parallel_segments(tmp_media):
+    def images():
+        gc.collect()
+        return {id(obj) for obj in gc.get_objects() if isinstance(obj, Image.Image)}
+
+    video = Video(os.path.join(tmp_media, "avi", "video.avi"), 0.1, 10, parallelism=3)
+    frames = video.extract_frames()
+    existing = images()
+
+    # The segments are spooled, so the decoded frames are not held in memory until their turn.
+    first = next(frames)
+    assert len(images() - existing) <= video.parallelism
+    assert len([first, *frames]) == 11
+
+    serial = Video(os.path.join(tmp_media, "avi", "video.avi"), 0.1, 10)
+    for expected, actual in zip(serial.extract_frames(), video.extract_frames()):
+        assert ImageStat.Stat(ImageChops.difference(expected, actual)).mean[0] < 5
+
+
+def test_api_generation_from_work_queue(tmp_media):
+    inputs = (os.path.join(tmp_media, "avi"), os.path.join(tmp_media, "ogv"))
+    directory = os.path.join(tmp_media, "queue")
+
+    # The lease of a crashed worker has expired, so it is reclaimed.
+    crashed = WorkQueue(directory, lease_timeout=3600)
+    crashed.put(os.path.join(tmp_media, "avi", "video.avi"))
+    assert crashed.lease() == os.path.join(tmp_media, "avi", "video.avi")
+    leased, = os.listdir(os.path.join(directory, "leased"))
+    os.utime(os.path.join(directory, "leased", leased), (0, 0))
+
+    def generate():
+        generator = Generator(inputs)
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.queue = directory
+        return generator.generate()
+
+    assert sorted(os.path.basename(result.filepath) for result in generate()) == ["video.avi", "video.ogv"]
+    assert len(os.listdir(os.path.join(directory, "done"))) == 2
+    assert not os.listdir(os.path.join(directory, "leased"))
+
+    # The done jobs are not processed again.
+    assert generate() == []
+
+
+def test_api_work_queue_drained_lazily(tmp_media, monkeypatch):
+    queue = WorkQueue(os.path.join(tmp_media, "queue"))
+    found = []
+
+    def discover():
+        for n in range(100):
+            found.append(n)
+            yield os.path.join(tmp_media, "%d.avi" % n)
+
+    # The leased job is yielded before the rest of the inputs are found.
+    drained = queue.drain(discover())
+    next(drained)
+    assert len(found) < 100
+
+    # The enqueued jobs are not enqueued again, even while they are leased, without listing the leases.
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "listdir", lambda path: pytest.fail("The leases are listed."))
+        assert not queue.put(os.path.join(tmp_media, "0.avi"))
+    assert len([None, *drained]) == 100
+
+
+def test_api_vtt_generation_with_canvases(tmp_media):
+    sheets = []
+
+    for canvas in ("pillow", "stream", "numpy"):
+        generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+        generator.compress = 0.1
+        generator.interval = 10
+        generator.sheet = (2, 2)
+        generator.canvas = canvas
+        generator.memory = 1
+        generator.sink = MemorySink()
+        result, = generator.generate()
+        sheets.append([generator.sink.files[path] for path in result.outputs if path.endswith(".png")])
+
+    # The sheets streamed row by row or composed in an array decode to the same pixels.
+    assert len(sheets[0]) == len(sheets[1]) == len(sheets[2]) == 3
+    for pillow, *others in zip(*sheets):
+        for other in others:
+            with Image.open(io.BytesIO(pillow)) as expected, Image.open(io.BytesIO(other)) as actual:
+                assert expected.size == actual.size
+                assert ImageChops.difference(expected.convert("RGB"), actual.convert("RGB")).getbbox() is None
+
+
+def test_api_generation_with_renditions(tmp_media):
+    generator = Generator((os.path.join(tmp_media, "avi", "video.avi"),))
+    generator.format = ("vtt", "json")
+    generator.compress = (0.05, 0.1)
+    generator.interval = 10
+    generator.output = os.path.join(tmp_media, "renditions")
+    result, = generator.generate()
+
+    # All the formats and renditions share a single extraction pass.
+    assert result.error is None
+    assert result.metrics.counters["ffmpeg_spawns"] == 1
+    assert len(result.cues) == 4 * 11
+    for name in ("video-256w.vtt", "video-256w.json", "video-128w.vtt", "video-128w.json"):
+        assert os.path.exists(os.path.join(tmp_media, "renditions", name))
+    assert len(os.listdir(os.path.join(tmp_media, "renditions", "video-128w"))) == 11
+
+    # The shared frames match the frames of a separate run.
+    generator.format = "vtt"
+    generator.compress = 0.05
+    generator.output = os.path.join(tmp_media, "single")
+    generator.generate()
+    with Image.open(os.path.join(tmp_media, "single", "video.png")) as expected, \
+            Image.open(os.path.join(tmp_media, "renditions", "video-128w.png")) as actual:
+        assert ImageChops.difference(expected.convert("RGB"), actual.convert("RGB")).getbbox() is None
+
+
+def test_api_generation_with_renditions_by_scenes(tmp_media):
+    generator = Generator((os.path.join(tmp_media, "avi"), os.path.join(tmp_media, "ogv")))
+    generator.compress = (0.05, 0.1)
+    generator.scene = 0.3
+    generator.output = os.path.join(tmp_media, "renditions")
+    results = generator.generate()
+
+    # The renditions sample the scenes detected once for their video, by a single pass spooling the frames of both.
+    assert len(results) == 2
+    for result in results:
+        assert result.error is None
+        assert result.metrics.counters["ffmpeg_spawns"] == 1
+        assert len(result.cues) % 2 == 0
+        assert result.cues[:len(result.cues) // 2] != result.cues[len(result.cues) // 2:]
+        assert [cue.start for cue in result.cues[:len(result.cues) // 2]] == \
+            [cue.start for cue in result.cues[len(result.cues) // 2:]]
+
+
+def test_api_import_defers_dependencies():
+    # The CLI is invoked per video by the batch jobs, so its startup should not import the heavy dependencies.
+    code = "import sys, thumbnails.__main__; print(*sys.modules)"
+    modules = set(subprocess.check_output((sys.executable, "-c", code)).decode().split())
+    assert not modules & {"av", "imageio", "imageio_ffmpeg", "numpy", "PIL", "rich", "distutils"}
+
+
+def test_api_keyframes_matched_to_index(tmp_media, monkeypatch):
+    # The VP9 decoder does not skip the non-keyframes, they must not be taken for the keyframes.
+    path = synthesize(os.path.join(tmp_media, "video.webm"), "-c:v", "libvpx-vp9", "-g", "25", "-b:v", "200k")
+
+    def assert_seeked_frames(video):
+        frames = list(video.extract_frames())
+        assert len(frames) == video.frames_count
+        for start, frame in zip(video.timestamps, frames):
+            assert ImageChops.difference(frame, video._extract_frame(start)).getbbox() is None
+
+    video = Video(path, 0.5, 1, keyframes=True)
+    assert video.timestamps == (0.0, 1.0, 2.0, 3.0, 4.0, 5.0)
+    assert_seeked_frames(video)
+    assert "keyframe_mismatches" not in video.metrics.counters
+
+    # If the decoded keyframes do not match the index, the frames are extracted by seeking.
+    monkeypatch.setattr(Video, "_load_keyframes", lambda self, filepath: [0.0, 2.0, 4.0])
+    video = Video(path, 0.5, 1, keyframes=True)
+    assert_seeked_frames(video)
+    assert video.metrics.counters["keyframe_mismatches"] == 1
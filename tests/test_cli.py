@@ -1,6 +1,9 @@
 import os
+import re
 import subprocess
 
+from thumbnails.ffmpeg import probe
+
 
 def execute_cli(*args, must_fail=False):
     assert subprocess.call(("thumbnails", *args)) == must_fail
@@ -51,3 +54,71 @@ def test_cli_only_directories(tmp_media):
     assert os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))
     assert os.path.exists(os.path.join(tmp_media, "ogv", "video.png"))
     assert os.path.exists(os.path.join(tmp_media, "ogv", "video.vtt"))
+
+
+def test_cli_keyframes(tmp_media):
+    execute_cli(
+        os.path.join(tmp_media, "avi", "video.avi"),
+        os.path.join(tmp_media, "ogv", "video.ogv"),
+        "-I",
+        "10",
+        "--keyframes",
+    )
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video.png"))
+
+    # The cues report the actual times of the frames, i.e. the keyframes nearest to the intervals.
+    for name in ("avi/video.avi", "ogv/video.ogv"):
+        keyframes = probe(os.path.join(tmp_media, name), keyframes=True)["keyframes"]
+        with open(os.path.join(tmp_media, os.path.splitext(name)[0] + ".vtt")) as fp:
+            cues = re.findall(r"^(\d+):(\d+):([\d.]+) -->", fp.read(), re.MULTILINE)
+        starts = [int(hours) * 3600 + int(minutes) * 60 + float(seconds) for hours, minutes, seconds in cues]
+        assert len(starts) > 1
+        for n, start in enumerate(starts):
+            nearest = min(abs(keyframe - n * 10) for keyframe in keyframes)
+            assert min(abs(keyframe - start) for keyframe in keyframes) < 1e-3
+            assert abs(abs(start - n * 10) - nearest) < 1e-3
+
+
+def test_cli_processes(tmp_media):
+    execute_cli(
+        os.path.join(tmp_media, "avi"),
+        os.path.join(tmp_media, "ogv"),
+        "-I",
+        "10",
+        "--processes",
+        "--jobs",
+        "2",
+        "--parallelism",
+        "2",
+    )
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video.png"))
+    assert os.path.exists(os.path.join(tmp_media, "ogv", "video.vtt"))
+
+
+def test_cli_discovery_filters(tmp_media):
+    execute_cli(
+        os.path.join(tmp_media, "avi"),
+        os.path.join(tmp_media, "ogv"),
+        "-I",
+        "10",
+        "--extension",
+        "avi",
+        "--extension",
+        "ogv",
+        "--exclude",
+        "*.ogv",
+    )
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))
+    assert not os.path.exists(os.path.join(tmp_media, "ogv", "video.vtt"))
+
+
+def test_cli_progress_modes(tmp_media):
+    for mode in ("aggregated", "none"):
+        execute_cli(
+            os.path.join(tmp_media, "avi", "video.avi"),
+            "-I",
+            "10",
+            "--progress",
+            mode,
+        )
+    assert os.path.exists(os.path.join(tmp_media, "avi", "video.vtt"))